@@ -0,0 +1,161 @@
+"""HTTP service for the summarizer, run with ``uvicorn api:app``.
+
+Sheets posted to /jobs are queued and summarized by a background worker pool; clients poll
+/jobs/{job_id} and download /jobs/{job_id}/result once it has finished, or with
+?partial=true for the rows done so far. Each job's files live in its own workspace directory,
+kept after the job finishes until the workspace evicts them.
+"""
+import os
+import time
+import uuid
+import threading
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+
+from cache import hash_bytes
+from sheets import MIME_TYPES, OUTPUT_FORMATS, SheetWriter, export_rows
+from metrics import BillTimings, render_prometheus
+import pipeline
+
+# Sheets summarized at the same time; each one also runs its own staged pipeline
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+
+app = FastAPI(title="Stateside Bill Summarization")
+jobs = {}
+_jobs_lock = threading.Lock()
+_writers = {}  # job_id -> SheetWriter of running jobs, for partial results
+_job_folders = {}  # job_id -> the job's workspace directory
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+
+class SummarizeRequest(BaseModel):
+    url: str
+    single_request: Optional[bool] = None
+
+
+def _update_job(job_id, **changes):
+    with _jobs_lock:
+        jobs[job_id].update(changes)
+
+
+def _spool_path(job_id):
+    return os.path.join(_job_folders[job_id], "summaries.csv")
+
+
+def _run_job(job_id, sheet_path, sheet_id, single_request):
+    _update_job(job_id, status="running", started_at=time.time())
+    writer = None
+    try:
+        sheet = pipeline.read_sheet(sheet_path)
+
+        def report_progress(done, total):
+            _update_job(job_id, done=done, total=total, rows_written=writer.rows_written)
+
+        row_timings = {}
+        writer = SheetWriter(_spool_path(job_id), load_row=lambda row_index: pipeline.journal.result(sheet_id, row_index))
+        _writers[job_id] = writer
+        try:
+            pipeline.summarize_sheet(sheet, sheet_id, single_request, progress_callback=report_progress,
+                                     row_timings=row_timings, writer=writer)
+        finally:
+            sheet.close()
+            os.remove(sheet_path)
+        _update_job(job_id, status="finished", finished_at=time.time(), rows_written=writer.rows_written,
+                    timings=row_timings)
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")  # Debugging
+        _update_job(job_id, status="failed", error=str(e), finished_at=time.time())
+    finally:
+        _writers.pop(job_id, None)
+        if writer:
+            writer.close()
+        pipeline.workspace.finish_job(_job_folders[job_id], remove=False)
+
+
+@app.post("/summaries")
+def summarize(request: SummarizeRequest):
+    """Summarizes one PDF or webpage URL synchronously."""
+    errors = {}
+    timings = BillTimings()
+    summaries = pipeline.summarize_url(request.url, request.single_request, errors, timings)
+    if summaries is None:
+        raise HTTPException(status_code=422, detail="Could not extract text from the URL")
+    extractive, abstractive, highlights = summaries
+    return {"extractive": extractive, "abstractive": abstractive, "highlights": highlights, "errors": errors,
+            "timings": timings.as_dict()}
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request, single_request: Optional[bool] = None):
+    """Queues the xlsx sheet sent as the request body."""
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="Send the xlsx sheet as the request body")
+
+    job_id = uuid.uuid4().hex
+    _job_folders[job_id] = pipeline.workspace.create_job()
+    sheet_path = os.path.join(_job_folders[job_id], "sheet.xlsx")
+    with open(sheet_path, "wb") as f:
+        f.write(data)
+
+    with _jobs_lock:
+        jobs[job_id] = {"id": job_id, "status": "queued", "done": 0, "total": None, "rows_written": 0,
+                        "error": None, "created_at": time.time()}
+        job = dict(jobs[job_id])
+    _executor.submit(_run_job, job_id, sheet_path, hash_bytes(data), single_request)
+    return job
+
+
+@app.get("/jobs")
+def list_jobs():
+    with _jobs_lock:
+        return [dict(job) for job in jobs.values()]
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    with _jobs_lock:
+        if job_id not in jobs:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        return dict(jobs[job_id])
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str, format: str = "xlsx", partial: bool = False):
+    """Returns the summaries as xlsx, csv or parquet.
+
+    With partial=true a running (or failed) job returns the rows finished so far, in sheet order.
+    """
+    job = get_job(job_id)
+    if format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(OUTPUT_FORMATS)}")
+    writer = _writers.get(job_id)
+    output_path = os.path.join(_job_folders[job_id], f"summaries_{uuid.uuid4().hex[:8]}.{format}")
+    spool_path = _spool_path(job_id)
+    try:
+        if writer is not None and partial:
+            writer.export(output_path, format)  # Locked against rows being appended meanwhile
+        elif job["status"] == "finished" or (job["status"] == "failed" and partial):
+            if not os.path.exists(spool_path):
+                status_code, detail = ((410, "The job's result has been evicted from the workspace")
+                                       if job["status"] == "finished" else (409, "Job failed before any rows were written"))
+                raise HTTPException(status_code=status_code, detail=detail)
+            # The writer of a finished or failed job is closed, so the spool file is complete
+            export_rows(spool_path, output_path, format)
+        else:
+            raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FileResponse(output_path, media_type=MIME_TYPES[format], filename=f"Summarized_Bills.{format}",
+                        background=BackgroundTask(os.remove, output_path))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Per-stage durations and counters in the Prometheus text format."""
+    return render_prometheus()
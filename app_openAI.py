@@ -2,10 +2,18 @@ import streamlit as st
 import requests
 from bs4 import BeautifulSoup
 import os
-from pdf2image import convert_from_path
+import threading
 import pytesseract
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import openai
 from bs4 import BeautifulSoup as BS
+from ocr import extract_text_from_pdf
+from cache import DiskCache, hash_bytes
+from fetch import FetchClient
+from workspace import Workspace
+from chunking import condense_text
+from structure import detect_structure, structure_to_text
+from summaries import SECTION_NAMES, SUMMARY_MODE, build_combined_prompt, parse_combined_response, run_concurrently
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -13,34 +21,33 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 
 openai.api_key = openai_api_key
 
+cache = DiskCache()
+fetch_client = FetchClient(cache)
+workspace = Workspace()
+# Leaves room in GPT-4's 8k context for the prompt and the response
+GPT_CHUNK_TOKEN_BUDGET = 5000
+# Linked documents downloaded and summarized at the same time
+LINKED_PDF_WORKERS = int(os.getenv("LINKED_PDF_WORKERS", 4))
+# Ask GPT for the HTML structure when the local detector finds no headings at all
+STRUCTURE_LLM_FALLBACK = os.getenv("STRUCTURE_LLM_FALLBACK", "0") == "1"
+
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
-def ensure_folder_exists(folder_name):
-    if not os.path.exists(folder_name):
-        os.makedirs(folder_name)
+def extract_pdf_text(pdf_path):
+    progress_bar = st.progress(0.0, text="Extracting text...")
 
-def convert_pdf_to_images(pdf_path, output_folder):
-    try:
-        pages = convert_from_path(pdf_path)
-        image_paths = []
-        for i, page in enumerate(pages):
-            image_path = os.path.join(output_folder, f"{os.path.basename(pdf_path)}_page_{i + 1}.jpg")
-            page.save(image_path, "JPEG")
-            image_paths.append(image_path)
-        return image_paths, len(pages)  
-    except Exception as e:
-        st.error(f"Failed to convert PDF to images: {e}")
-        return [], 0
+    def report_progress(done, total):
+        progress_bar.progress(done / total, text=f"Extracting text: {done}/{total} pages")
 
-def extract_text_from_image(image_path):
     try:
-        text = pytesseract.image_to_string(image_path, config='--psm 6')  
-        return text
-    except Exception as e:
-        st.error(f"Failed to extract text from image: {e}")
-        return None
+        page_texts, failed_pages = extract_text_from_pdf(pdf_path, progress_callback=report_progress, cache=cache)
+    finally:
+        workspace.release(pdf_path)  # Stored PDFs are kept from eviction until read
+    for page, error in failed_pages:
+        st.error(f"Failed to extract text from page {page}: {error}")
+    return "".join(page_texts), len(page_texts)
 
-def process_text_with_gpt(text, prompt):
+def process_text_with_gpt(text, prompt, errors=None):
     try:
         response = openai.ChatCompletion.create(
             model="gpt-4",
@@ -50,9 +57,20 @@ def process_text_with_gpt(text, prompt):
         html_content = response['choices'][0]['message']['content']
         return html_content
     except Exception as e:
-        st.error(f"Error processing text with GPT: {e}")
+        if errors is None:
+            st.error(f"Error processing text with GPT: {e}")
+        else:
+            errors["structure"] = e
         return None
 
+def chat_with_gpt(prompt):
+    response = openai.ChatCompletion.create(
+        model="gpt-4",
+        messages=[{"role": "system", "content": "You are a helpful assistant."},
+                  {"role": "user", "content": prompt}]
+    )
+    return response['choices'][0]['message']['content']
+
 def html_to_json(html_content):
     try:
         soup = BS(html_content, "html.parser")
@@ -86,7 +104,31 @@ def html_to_json(html_content):
         st.error(f"Failed to convert HTML to JSON: {e}")
         return []
 
-def generate_summaries(combined_text, num_pages):
+def structure_text(all_text, prompt, errors=None):
+    """Returns the document's headings and paragraphs as json_data.
+
+    The local detector handles the usual bill layouts; GPT is only asked for HTML when the
+    fallback is switched on and no headings were found.
+    """
+    json_data = detect_structure(all_text)
+    if llm_structure_fallback and not any(entry["text_type"] == "heading" for entry in json_data):
+        html_content = process_text_with_gpt(all_text, prompt, errors)
+        if html_content:
+            json_data = html_to_json(html_content) or json_data
+    return json_data
+
+def generate_summaries(combined_text, num_pages, single_request=None, errors=None):
+    """Returns (extractive, abstractive, highlights).
+
+    Failures are shown with st.error, or collected into the errors dict when one is given so the
+    function can run off the Streamlit script thread.
+    """
+    def report(name, error):
+        if errors is None:
+            st.error(f"Error generating {name}: {error}")
+        else:
+            errors[name] = error
+
     if num_pages == 4:
         extractive_paragraph_limit = 4
         abstractive_paragraph_limit = 2
@@ -94,49 +136,121 @@ def generate_summaries(combined_text, num_pages):
         extractive_paragraph_limit = num_pages  
         abstractive_paragraph_limit = 2  
 
+    # GPT-4's 8k context can't take a whole bill, so long text is condensed chunk by chunk first
+    combined_text, chunk_errors = condense_text(combined_text, chat_with_gpt, max_tokens=GPT_CHUNK_TOKEN_BUDGET)
+    if chunk_errors:
+        # Summarizing what's left would silently drop the failed parts of the text
+        for part, error in chunk_errors.items():
+            report(f"summary of {part} of the text", error)
+        return None, None, None
+
     extractive_prompt = f"Generate an extractive summary of the following text with {extractive_paragraph_limit} paragraphs:\n\n{combined_text}"
 
     abstractive_prompt = f"Generate an abstractive summary of the following text in {abstractive_paragraph_limit} paragraphs:\n\n{combined_text}"
 
     highlights_prompt = f"Generate highlights and analysis of the following text. Provide a maximum of 15-20 bullet points divided under 4 broad headings:\n\n{combined_text}"
 
-    try:
-        extractive_response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "system", "content": "You are a helpful assistant."},
-                      {"role": "user", "content": extractive_prompt}]
-        )
-        extractive_summary = extractive_response['choices'][0]['message']['content']
-        
-        abstractive_response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "system", "content": "You are a helpful assistant."},
-                      {"role": "user", "content": abstractive_prompt}]
-        )
-        abstractive_summary = abstractive_response['choices'][0]['message']['content']
+    if single_request is None:
+        single_request = SUMMARY_MODE == "single"
 
-        highlights_response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "system", "content": "You are a helpful assistant."},
-                      {"role": "user", "content": highlights_prompt}]
+    if single_request:
+        combined_prompt = build_combined_prompt(
+            f"Generate an extractive summary of the text with {extractive_paragraph_limit} paragraphs.",
+            f"Generate an abstractive summary of the text in {abstractive_paragraph_limit} paragraphs.",
+            "Generate highlights and analysis of the text. Provide a maximum of 15-20 bullet points divided under 4 broad headings.",
+            combined_text,
         )
-        highlights_summary = highlights_response['choices'][0]['message']['content']
+        responses, summary_errors = run_concurrently({"combined": lambda: chat_with_gpt(combined_prompt)})
+        if "combined" in summary_errors:
+            results, summary_errors = {}, {name: summary_errors["combined"] for name in SECTION_NAMES}
+        else:
+            results, summary_errors = parse_combined_response(responses["combined"])
+    else:
+        results, summary_errors = run_concurrently({
+            "extractive": lambda: chat_with_gpt(extractive_prompt),
+            "abstractive": lambda: chat_with_gpt(abstractive_prompt),
+            "highlights": lambda: chat_with_gpt(highlights_prompt),
+        })
 
-        return extractive_summary, abstractive_summary, highlights_summary
-    except Exception as e:
-        st.error(f"Error generating summaries: {e}")
-        return None, None, None
+    for name, error in summary_errors.items():
+        report(f"{name} summary", error)
+    return tuple(results.get(name) for name in SECTION_NAMES)
 
-def scrape_and_download_pdfs(url, prompt):
+def process_linked_pdf(pdf_url, pdf_name, prompt, seen_hashes, seen_lock):
+    """Downloads, extracts and summarizes one linked PDF off the Streamlit script thread.
+
+    Returns a result dict for the main thread to render. A PDF whose content was already claimed
+    by another link comes back with "duplicate_of" set and is not processed again.
+    """
+    result = {"name": pdf_name, "url": pdf_url, "duplicate_of": None, "summaries": None,
+              "failed_pages": [], "errors": {}}
+    content = fetch_client.fetch(pdf_url).content
+    content_hash = hash_bytes(content)
+    with seen_lock:
+        if content_hash in seen_hashes:
+            result["duplicate_of"] = seen_hashes[content_hash]
+            return result
+        seen_hashes[content_hash] = pdf_name
+
+    pdf_path = workspace.store(content)
+    try:
+        page_texts, result["failed_pages"] = extract_text_from_pdf(pdf_path, cache=cache)
+    finally:
+        workspace.release(pdf_path)
+    all_text = "".join(page_texts)
+    if all_text:
+        json_data = structure_text(all_text, prompt, result["errors"])
+        combined_text = structure_to_text(json_data)
+        result["summaries"] = generate_summaries(combined_text, len(page_texts), errors=result["errors"])
+    return result
+
+def process_linked_pdfs(documents, prompt):
+    """Processes {pdf_url: pdf_name} concurrently, rendering each document as soon as it is done."""
+    progress_bar = st.progress(0.0, text="Processing documents...")
+    seen_hashes, seen_lock = {}, threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=LINKED_PDF_WORKERS)
     try:
-        downloads_folder = "downloads"
-        ensure_folder_exists(downloads_folder)
-        images_folder = "images"
-        ensure_folder_exists(images_folder)
+        futures = {
+            executor.submit(process_linked_pdf, pdf_url, pdf_name, prompt, seen_hashes, seen_lock):
+                pdf_name
+            for pdf_url, pdf_name in documents.items()
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            progress_bar.progress(done / len(futures), text=f"Processed {done}/{len(futures)} documents")
+            pdf_name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                st.error(f"Failed to process {pdf_name}: {e}")
+                continue
+            if result["duplicate_of"]:
+                st.info(f"{pdf_name} is the same document as {result['duplicate_of']}, skipped.")
+                continue
 
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
+            st.header(pdf_name)
+            for page, error in result["failed_pages"]:
+                st.error(f"Failed to extract text from page {page}: {error}")
+            for name, error in result["errors"].items():
+                st.error(f"Error generating {name}: {error}")
+            if result["summaries"] is None:
+                st.warning("No text could be extracted from this document.")
+                continue
+            extractive_summary, abstractive_summary, highlights_summary = result["summaries"]
+
+            st.subheader("Extractive Summary")
+            st.write(extractive_summary)
+
+            st.subheader("Abstractive Summary")
+            st.write(abstractive_summary)
+
+            st.subheader("Highlights and Analysis")
+            st.write(highlights_summary)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def scrape_and_download_pdfs(url, prompt):
+    try:
+        soup = BeautifulSoup(fetch_client.fetch(url).content, "html.parser")
 
         relevant_section = soup.find("span", class_="file_uploads_title", string="Relevant Links")
         if relevant_section:
@@ -144,39 +258,13 @@ def scrape_and_download_pdfs(url, prompt):
             if pdf_list_section:
                 pdf_links = pdf_list_section.find("ul", class_="pdf_html_links").find_all("a")
                 if pdf_links:
-                    st.success(f"Found {len(pdf_links)} PDF(s). Processing...")
+                    # The same document is often linked more than once
+                    documents = {}
                     for idx, pdf_link in enumerate(pdf_links):
                         pdf_url = requests.compat.urljoin(url, pdf_link["href"])
-                        pdf_name = pdf_link.text.strip() or f"downloaded_pdf_{idx + 1}.pdf"
-                        pdf_response = requests.get(pdf_url)
-                        local_pdf_path = os.path.join(downloads_folder, f"{pdf_name.replace(' ', '_')}.pdf")
-                        with open(local_pdf_path, "wb") as pdf_file:
-                            pdf_file.write(pdf_response.content)
-                        
-                        image_paths, num_pages = convert_pdf_to_images(local_pdf_path, images_folder)
-                        if image_paths:
-                            all_text = ""
-                            for image_path in image_paths:
-                                extracted_text = extract_text_from_image(image_path)
-                                if extracted_text:
-                                    all_text += extracted_text  
-                                    
-                            if all_text:
-                                html_content = process_text_with_gpt(all_text, prompt)
-                                if html_content:
-                                    json_data = html_to_json(html_content)
-                                    combined_text = " ".join([entry['text'] for entry in json_data if entry['text']])
-                                    extractive_summary, abstractive_summary, highlights_summary = generate_summaries(combined_text, num_pages)
-                                    
-                                    st.subheader("Extractive Summary")
-                                    st.write(extractive_summary)
-                                    
-                                    st.subheader("Abstractive Summary")
-                                    st.write(abstractive_summary)
-
-                                    st.subheader("Highlights and Analysis")
-                                    st.write(highlights_summary)
-
+                        documents.setdefault(pdf_url, pdf_link.text.strip() or f"downloaded_pdf_{idx + 1}")
+                    st.success(f"Found {len(documents)} PDF(s). Processing...")
+                    process_linked_pdfs(documents, prompt)
                 else:
                     st.warning("No PDFs found under 'Relevant Links'.")
             else:
@@ -188,6 +276,11 @@ def scrape_and_download_pdfs(url, prompt):
 
 st.title("Summarization - prsindia")
 
+llm_structure_fallback = st.sidebar.checkbox(
+    "Use GPT for documents without detectable headings", value=STRUCTURE_LLM_FALLBACK,
+    help="Costs an extra GPT-4 call over the whole document, only when no headings are found"
+)
+
 prompt = (
     "You are an HTML extractor bot. You will be provided with extracted text. "
     "Your goal is to convert the text into HTML format. Ensure that the HTML has "
@@ -199,36 +292,20 @@ option = st.radio("Choose an option:", ("Upload a PDF", "Input a website link"))
 if option == "Upload a PDF":
     uploaded_pdf = st.file_uploader("Upload a PDF file", type=["pdf"])
     if uploaded_pdf is not None:
-        uploads_folder = "uploads"
-        ensure_folder_exists(uploads_folder)
-        images_folder = "images"
-        ensure_folder_exists(images_folder)
-        file_path = os.path.join(uploads_folder, uploaded_pdf.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_pdf.read())
-        image_paths, num_pages = convert_pdf_to_images(file_path, images_folder)
-        if image_paths:
-            all_text = ""
-            for image_path in image_paths:
-                extracted_text = extract_text_from_image(image_path)
-                if extracted_text:
-                    all_text += extracted_text  
-                    
-            if all_text:
-                html_content = process_text_with_gpt(all_text, prompt)
-                if html_content:
-                    json_data = html_to_json(html_content)
-                    combined_text = " ".join([entry['text'] for entry in json_data if entry['text']])
-                    extractive_summary, abstractive_summary, highlights_summary = generate_summaries(combined_text, num_pages)
-                    
-                    st.subheader("Extractive Summary")
-                    st.write(extractive_summary)
-                    
-                    st.subheader("Abstractive Summary")
-                    st.write(abstractive_summary)
-
-                    st.subheader("Highlights and Analysis")
-                    st.write(highlights_summary)
+        all_text, num_pages = extract_pdf_text(workspace.store(uploaded_pdf.getvalue()))
+        if all_text:
+            json_data = structure_text(all_text, prompt)
+            combined_text = structure_to_text(json_data)
+            extractive_summary, abstractive_summary, highlights_summary = generate_summaries(combined_text, num_pages)
+                
+            st.subheader("Extractive Summary")
+            st.write(extractive_summary)
+                
+            st.subheader("Abstractive Summary")
+            st.write(abstractive_summary)
+
+            st.subheader("Highlights and Analysis")
+            st.write(highlights_summary)
 
 elif option == "Input a website link":
     website_url = st.text_input("Enter the website URL:")
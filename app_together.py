@@ -1,286 +1,243 @@
 import os
-import requests
+import time
+import queue
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from pdf2image import convert_from_path
-import pytesseract
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
-from together import Together
 import streamlit as st
-import io
+from cache import CACHE_ENABLED, hash_bytes, set_cache_enabled
+from batch import DOWNLOAD_WORKERS, LLM_WORKERS, OCR_WORKERS
+from summaries import SECTION_NAMES, SUMMARY_MODE
+from metrics import bill_timings
+from sheets import MIME_TYPES, OUTPUT_FORMATS, SheetWriter
+from pipeline import (
+    cache, journal, workspace, download_pdf_from_url, extract_text_from_webpage,
+    generate_summaries_with_together_ai, read_sheet, summarize_sheet
+)
+import pipeline
 
-load_dotenv()
-together_api_key = os.getenv("TOGETHER_AI_API_KEY")
-client = Together(api_key=together_api_key)
+# Seconds between refreshes of the mid-run partial download
+PARTIAL_DOWNLOAD_INTERVAL = 15
 
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'  
+SECTION_TITLES = ("Extractive Summary", "Abstractive Summary", "Highlights and Analysis")
 
 
-def clean_summary(text):
-    """Cleans the summary by removing instructions and markdown-style bold formatting."""
-    if not text:
-        return ""
+def extract_pdf_text(pdf_path):
+    """Extracts the text of a PDF stored in the workspace with a progress bar, warning about pages
+    that failed, then releases the PDF for eviction."""
+    progress_bar = st.progress(0.0, text="Extracting text...")
 
-    # List of instruction phrases to remove
-    instruction_phrases = [
-        "Here is a 2-paragraph extractive summary of the text:",
-        "Here is a 2-paragraph abstractive summary of the provided text:",
-        "Here are the highlights in 15-20 bullet points under 4 headings:",
-        "Here is a 2-paragraph abstractive summary of the text:"
-    ]
+    def report_progress(done, total):
+        progress_bar.progress(done / total, text=f"Extracting text: {done}/{total} pages")
 
-    # Remove instruction phrases at the beginning
-    for phrase in instruction_phrases:
-        if text.startswith(phrase):
-            text = text[len(phrase):].lstrip()
-
-    # Remove markdown-like bold formatting (**text**)
-    text = text.replace("**", "").replace("### ", "")
-
-    return text.strip()
-
-
-
-def ensure_folder_exists(folder_name):
-    if not os.path.exists(folder_name):
-        os.makedirs(folder_name)
-
-def download_pdf_from_url(url, output_folder):
-    try:
-        ensure_folder_exists(output_folder)  # Ensure folder exists before saving
-        
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        content_type = response.headers.get("Content-Type", "")
-
-        print(f"Downloading {url}, Content-Type: {content_type}")  # Debugging
-
-        if "application/pdf" not in content_type and not url.lower().endswith(".pdf"):
-            print(f"Skipping non-PDF URL: {url}")
-            return None
-
-        pdf_name = url.split("/")[-1] or "downloaded_pdf.pdf"
-        pdf_path = os.path.join(output_folder, pdf_name)
-        
-        with open(pdf_path, "wb") as pdf_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                pdf_file.write(chunk)
-        
-        print(f"PDF saved at {pdf_path}")  # Debugging
-        return pdf_path
-    except Exception as e:
-        print(f"Error downloading PDF: {e}")  # Debugging
-        return None
-
-
-def convert_pdf_to_images(pdf_path, output_folder):
-    try:
-        ensure_folder_exists(output_folder)  # Ensure output folder exists
-        poppler_path = r"C:\\Release-24.08.0-0\\poppler-24.08.0\\Library\\bin"
-
-        print(f"Converting PDF to images: {pdf_path}")  # Debugging
-        
-        if not os.path.exists(pdf_path):
-            print(f"PDF file does not exist: {pdf_path}")
-            return [], 0
-
-        pages = convert_from_path(pdf_path, poppler_path=poppler_path)
-
-        image_paths = []
-        for i, page in enumerate(pages):
-            image_path = os.path.join(output_folder, f"{os.path.basename(pdf_path)}_page_{i + 1}.jpg")
-            page.save(image_path, "JPEG")
-            image_paths.append(image_path)
-
-        print(f"Converted {len(image_paths)} pages to images")  # Debugging
-        return image_paths, len(pages)
-
-    except Exception as e:
-        print(f"Error converting PDF to images: {e}")  # Debugging
-        return [], 0
-
-def extract_text_from_image(image_path):
+    failed_pages = []
     try:
-        return pytesseract.image_to_string(image_path, config='--psm 6')
-    except Exception as e:
-        return ""
+        all_text, num_pages = pipeline.extract_pdf_text(pdf_path, progress_callback=report_progress,
+                                                        failed_pages=failed_pages)
+    finally:
+        workspace.release(pdf_path)
+    if failed_pages:
+        st.warning(f"OCR failed on page(s): {', '.join(str(page) for page, _ in failed_pages)}")
+    return all_text, num_pages
+
+
+def summarize_live(text, num_pages):
+    """Generates the summaries on a worker thread and renders each section as its tokens arrive.
+
+    Streamlit elements may only be updated from the script thread, so the worker pushes partial
+    text onto a queue that this thread drains into one placeholder per section.
+    """
+    placeholders = {}
+    for name, title in zip(SECTION_NAMES, SECTION_TITLES):
+        st.subheader(title)
+        placeholders[name] = st.empty()
+        placeholders[name].caption("Waiting for the model...")
+
+    updates = queue.Queue()
+    errors = {}
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(contextvars.copy_context().run, generate_summaries_with_together_ai, text, num_pages,
+                             single_request, errors, lambda name, partial: updates.put((name, partial)))
+    executor.shutdown(wait=False)
+
+    while not future.done() or not updates.empty():
+        latest = {}
+        try:
+            name, partial = updates.get(timeout=0.1)
+            latest[name] = partial
+            while True:  # Only the newest text per section is worth rendering
+                name, partial = updates.get_nowait()
+                latest[name] = partial
+        except queue.Empty:
+            pass
+        for name, partial in latest.items():
+            placeholders[name].markdown(partial)
+
+    summaries = future.result()
+    for name, summary in zip(SECTION_NAMES, summaries):
+        if summary:
+            placeholders[name].write(summary)
+        else:
+            placeholders[name].warning(f"{name.capitalize()} summary failed: {errors.get(name, 'no response')}")
+    return summaries
+
+
+def display_timings(timings):
+    """Shows where the time for one bill went, slowest stage first."""
+    stages = sorted(timings.as_dict().items(), key=lambda item: item[1], reverse=True)
+    if stages:
+        st.caption("Time per stage: " + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stages))
 
-def extract_text_from_webpage(url):
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        return soup.get_text(separator=" ")
-    except Exception as e:
-        return ""
-
-def query_together_ai(prompt):
-    """Generates a summary using Together AI and cleans it before returning."""
-    try:
-        response = client.chat.completions.create(
-            model="meta-llama/Llama-3.3-70B-Instruct-Turbo",
-            messages=[{"role": "user", "content": prompt}],
-            stream=True
-        )
-        result = ""
-        for token in response:
-            if hasattr(token, 'choices'):
-                result += token.choices[0].delta.content
-        
-        return clean_summary(result)  # Clean summary before returning
-    except Exception as e:
-        return None
-
-
-def generate_summaries_with_together_ai(combined_text, num_pages):
-    extractive_prompt = f"Generate an extractive summary with {min(num_pages, 4)} paragraphs:\n\n{combined_text}"
-    abstractive_prompt = f"Generate an abstractive summary in 2 paragraphs:\n\n{combined_text}"
-    highlights_prompt = f"Generate highlights in 15-20 bullet points under 4 headings:\n\n{combined_text}"
-    
-    extractive = query_together_ai(extractive_prompt)
-    abstractive = query_together_ai(abstractive_prompt)
-    highlights = query_together_ai(highlights_prompt)
 
-    return extractive, abstractive, highlights
+st.title("Stateside Bill Summarization")
 
+# pipeline.cache is shared by every session, so the choice only applies to this session's script run
+set_cache_enabled(st.sidebar.checkbox("Use cache", value=CACHE_ENABLED,
+                                      help="Reuse downloads, extracted text and summaries from earlier runs"))
+single_request = st.sidebar.checkbox("Single request per bill", value=SUMMARY_MODE == "single",
+                                     help="Ask for all three summaries in one LLM response")
 
-st.title("Stateside Bill Summarization")
+if "output_path" not in st.session_state:
+    st.session_state.output_path = None  # Finished summaries file on disk
+    st.session_state.output_format = None
+if "row_timings" not in st.session_state:
+    st.session_state.row_timings = None  # Store per-bill stage timings
 
 option = st.radio("Choose an option:", ("Upload a PDF", "Input a website link", "Upload an Excel file"))
 
 if option == "Upload a PDF":
     uploaded_pdf = st.file_uploader("Upload a PDF file", type=["pdf"])
     if uploaded_pdf:
-        uploads_folder = "uploads"
-        ensure_folder_exists(uploads_folder)
-        images_folder = "images"
-        ensure_folder_exists(images_folder)
-        
-        pdf_path = os.path.join(uploads_folder, uploaded_pdf.name)
-        with open(pdf_path, "wb") as f:
-            f.write(uploaded_pdf.read())
-        
-        image_paths, num_pages = convert_pdf_to_images(pdf_path, images_folder)
-        if image_paths:
-            all_text = "".join([extract_text_from_image(img) for img in image_paths])
-            summaries = generate_summaries_with_together_ai(all_text, num_pages)
-            st.subheader("Extractive Summary")
-            st.write(summaries[0])
-            st.subheader("Abstractive Summary")
-            st.write(summaries[1])
-            st.subheader("Highlights and Analysis")
-            st.write(summaries[2])
+        # Stored under its content hash, so sessions uploading same-named files don't clash
+        pdf_path = workspace.store(uploaded_pdf.getvalue())
+
+        with bill_timings() as timings:
+            all_text, num_pages = extract_pdf_text(pdf_path)
+            if all_text.strip():
+                summarize_live(all_text, num_pages)
+        display_timings(timings)
 
 elif option == "Input a website link":
     url = st.text_input("Enter the URL:")
     if url:
-        if url.lower().endswith(".pdf"):  # PDF Link
-            downloads_folder = "downloads"
-            ensure_folder_exists(downloads_folder)
-            images_folder = "images"
-            ensure_folder_exists(images_folder)
-
-            pdf_path = download_pdf_from_url(url, downloads_folder)
-            if pdf_path:
-                image_paths, num_pages = convert_pdf_to_images(pdf_path, images_folder)
-                if image_paths:
-                    all_text = "".join([extract_text_from_image(img) for img in image_paths])
-                    summaries = generate_summaries_with_together_ai(all_text, num_pages)
-                    st.subheader("Extractive Summary")
-                    st.write(summaries[0])
-                    st.subheader("Abstractive Summary")
-                    st.write(summaries[1])
-                    st.subheader("Highlights and Analysis")
-                    st.write(summaries[2])
+        with bill_timings() as timings:
+            if url.lower().endswith(".pdf"):  # PDF Link
+                pdf_path = download_pdf_from_url(url)
+                if pdf_path:
+                    all_text, num_pages = extract_pdf_text(pdf_path)
+                    if all_text.strip():
+                        summarize_live(all_text, num_pages)
+                    else:
+                        st.error("Could not extract text from the PDF.")
                 else:
-                    st.error("Could not extract text from the PDF.")
-            else:
-                st.error("Failed to download the PDF.")
-        else:  # Webpage Link
-            webpage_text = extract_text_from_webpage(url)
-            if webpage_text.strip():
-                summaries = generate_summaries_with_together_ai(webpage_text, 3)
-                st.subheader("Extractive Summary")
-                st.write(summaries[0])
-                st.subheader("Abstractive Summary")
-                st.write(summaries[1])
-                st.subheader("Highlights and Analysis")
-                st.write(summaries[2])
-            else:
-                st.error("Failed to extract text from the webpage.")
-
-if "summary_df" not in st.session_state:
-    st.session_state.summary_df = None  # Store summaries
-if "excel_buffer" not in st.session_state:
-    st.session_state.excel_buffer = None  # Store Excel file
+                    st.error("Failed to download the PDF.")
+            else:  # Webpage Link
+                page_stats = {}
+                webpage_text = extract_text_from_webpage(url, page_stats)
+                if page_stats.get("saved_tokens"):
+                    st.caption(f"Sending about {page_stats['tokens']:,} tokens of page text instead of "
+                               f"{page_stats['full_tokens']:,} ({page_stats['saved_tokens']:,} saved per request)")
+                if webpage_text.strip():
+                    summarize_live(webpage_text, 3)
+                else:
+                    st.error("Failed to extract text from the webpage.")
+        display_timings(timings)
 
 elif option == "Upload an Excel file":
     uploaded_excel = st.file_uploader("Upload an Excel file", type=["xlsx"])
+
+    with st.expander("Batch settings"):
+        download_workers = st.number_input("Concurrent downloads", min_value=1, value=DOWNLOAD_WORKERS)
+        ocr_workers = st.number_input("Concurrent text extractions", min_value=1, value=OCR_WORKERS)
+        llm_workers = st.number_input("Concurrent bills being summarized", min_value=1, value=LLM_WORKERS)
     
-    if uploaded_excel and st.session_state.summary_df is None:  # Avoid reprocessing
-        df = pd.read_excel(uploaded_excel)
-        
-        if "BillTextURL" in df.columns:
-            if "BillState" not in df.columns:
-                df["BillState"] = "Unknown"  # Default if missing
-            
-            results = []  # Store processed results
-            
-            for index, row in df.iterrows():
-                url = str(row["BillTextURL"]).strip()
-                bill_state = row["BillState"]
-                
-                abstractive_summary, extractive_summary, highlights_summary = "", "", ""
-
-                if url.lower().endswith(".pdf"):  # PDF URL
-                    pdf_path = download_pdf_from_url(url, "downloads")
-                    
-                    if pdf_path:
-                        image_paths, num_pages = convert_pdf_to_images(pdf_path, "images")
-                        
-                        if image_paths:
-                            all_text = "".join([extract_text_from_image(img) for img in image_paths])
-                            summaries = generate_summaries_with_together_ai(all_text, num_pages)
-                            
-                            extractive_summary = clean_summary(summaries[0]) or "N/A"
-                            abstractive_summary = clean_summary(summaries[1]) or "N/A"
-                            highlights_summary = clean_summary(summaries[2]) or "N/A"
-                
-                else:  # Webpage URL
-                    webpage_text = extract_text_from_webpage(url)
-                    
-                    if webpage_text.strip():
-                        summaries = generate_summaries_with_together_ai(webpage_text, 3)
-                        
-                        extractive_summary = clean_summary(summaries[0]) or "N/A"
-                        abstractive_summary = clean_summary(summaries[1]) or "N/A"
-                        highlights_summary = clean_summary(summaries[2]) or "N/A"
-                
-                results.append({
-                    "BillState": bill_state,
-                    "BillTextURL": url,
-                    "Extractive Summary": extractive_summary,
-                    "Abstractive Summary": abstractive_summary,
-                    "Highlights and Analysis": highlights_summary
-                })
-
-            # Store results in session_state
-            st.session_state.summary_df = pd.DataFrame(results)
-
-            # Save to Excel in-memory
-            excel_buffer = io.BytesIO()
-            with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
-                st.session_state.summary_df.to_excel(writer, index=False, sheet_name="Summaries")
-            excel_buffer.seek(0)
-            
-            # Store the file in session state
-            st.session_state.excel_buffer = excel_buffer
+    output_format = st.selectbox("Output format", OUTPUT_FORMATS,
+                                 help="Parquet needs pyarrow; all formats are written row by row")
+
+    if uploaded_excel and st.session_state.output_path is None:  # Avoid reprocessing
+        try:
+            sheet = read_sheet(uploaded_excel)
+        except ValueError as e:
+            st.error(str(e))
+            sheet = None
+
+        if sheet is not None:
+            sheet_id = hash_bytes(uploaded_excel.getvalue())
+            progress_bar = st.progress(0.0, text="Processing bills...")
+            partial_download = st.empty()
+            run_folder = workspace.create_job()
+            writer = SheetWriter(os.path.join(run_folder, "summaries.csv"),
+                                 load_row=lambda row_index: journal.result(sheet_id, row_index))
+            last_partial = time.monotonic()
+
+            def report_progress(done, total):
+                global last_partial
+                progress_bar.progress(done / max(total, 1), text=f"Processed {done}/{total} bills")
+                # Offer the rows finished so far; CSV is just the spool file, so this stays cheap
+                if writer.rows_written and done < total and time.monotonic() - last_partial > PARTIAL_DOWNLOAD_INTERVAL:
+                    last_partial = time.monotonic()
+                    partial_download.download_button(
+                        label=f"Download the first {writer.rows_written} rows (CSV)",
+                        data=writer.export_bytes("csv"), file_name="Summarized_Bills_partial.csv",
+                        mime=MIME_TYPES["csv"], key=f"partial-{done}", on_click="ignore"
+                    )
+
+            resumed = len(journal.completed_row_indexes(sheet_id))
+            if resumed:
+                st.info(f"Resuming: {resumed} of {len(sheet)} rows were already summarized in an earlier run.")
+
+            row_timings = {}
+            try:
+                summarize_sheet(sheet, sheet_id, single_request, int(download_workers), int(ocr_workers),
+                                int(llm_workers), progress_callback=report_progress, row_timings=row_timings,
+                                writer=writer)
+                partial_download.empty()
+                st.session_state.row_timings = row_timings
+
+                # Keep the finished file on disk; only its path lives in the session
+                output_path = os.path.join(run_folder, f"Summarized_Bills.{output_format}")
+                writer.export(output_path, output_format)
+                st.session_state.output_path = output_path
+                st.session_state.output_format = output_format
+            except ValueError as e:
+                st.error(str(e))
+            finally:
+                writer.close()
+                sheet.close()
+                # The output stays downloadable until the workspace evicts it
+                workspace.finish_job(run_folder, remove=False)
+
+    if uploaded_excel and st.button("Start over", help="Discard saved progress for this sheet and summarize it again"):
+        journal.clear(hash_bytes(uploaded_excel.getvalue()))
+        st.session_state.output_path = None
+        st.session_state.row_timings = None
+        st.rerun()
 
     # Once the summaries are generated, show download button
-    if st.session_state.summary_df is not None and st.session_state.excel_buffer is not None:
-        st.download_button(
-            label="Download Summary Excel",
-            data=st.session_state.excel_buffer,
-            file_name="Summarized_Bills.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+    if st.session_state.output_path is not None and os.path.exists(st.session_state.output_path):
+        with open(st.session_state.output_path, "rb") as output_file:
+            st.download_button(
+                label=f"Download Summaries ({st.session_state.output_format})",
+                data=output_file,
+                file_name=f"Summarized_Bills.{st.session_state.output_format}",
+                mime=MIME_TYPES[st.session_state.output_format]
+            )
+
+    if st.session_state.row_timings:
+        with st.expander("Time per bill"):
+            timings_df = pd.DataFrame.from_dict(st.session_state.row_timings, orient="index").fillna(0.0)
+            timings_df.index = [f"Row {row_index + 1}" for row_index in timings_df.index]
+            st.dataframe(timings_df)
+
+cache_stats = cache.stats()
+if cache_stats["enabled"]:
+    st.sidebar.caption(
+        f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+        f"{cache_stats['size_bytes'] / 1e6:.1f} of {cache_stats['max_bytes'] / 1e6:.0f} MB used"
+    )
+
+workspace_stats = workspace.stats()
+if not workspace_stats["in_memory"]:
+    st.sidebar.caption(
+        f"Workspace: {workspace_stats['size_bytes'] / 1e6:.1f} of {workspace_stats['max_bytes'] / 1e6:.0f} MB used"
+    )
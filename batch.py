@@ -0,0 +1,184 @@
+import os
+import time
+import queue
+import random
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from metrics import increment
+
+try:
+    import together
+except ImportError:  # Only the Streamlit/pipeline side talks to Together
+    together = None
+
+DOWNLOAD_WORKERS = int(os.getenv("BATCH_DOWNLOAD_WORKERS", 8))
+OCR_WORKERS = int(os.getenv("BATCH_OCR_WORKERS", 2))
+LLM_WORKERS = int(os.getenv("BATCH_LLM_WORKERS", 4))
+# Jobs between starting the first stage and being handed back; bounds the texts (and in-memory PDFs)
+# held at once when downloads run ahead of the LLM stage. 0 means twice the total worker count
+MAX_JOBS_IN_FLIGHT = int(os.getenv("BATCH_MAX_IN_FLIGHT", 0))
+
+# Together API limits; 0 means unlimited
+TOGETHER_RPM = int(os.getenv("TOGETHER_RPM", 600))
+TOGETHER_TPM = int(os.getenv("TOGETHER_TPM", 0))
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Token-bucket limiter for requests per minute and (estimated) tokens per minute."""
+
+    def __init__(self, requests_per_minute=TOGETHER_RPM, tokens_per_minute=TOGETHER_TPM):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute)
+        self._token_allowance = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(self.requests_per_minute,
+                                          self._request_allowance + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._token_allowance = min(self.tokens_per_minute,
+                                        self._token_allowance + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens=0):
+        """Blocks until one request costing roughly `tokens` tokens may be sent."""
+        # A single request larger than the whole budget would otherwise wait forever
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                waits = []
+                if self.requests_per_minute and self._request_allowance < 1:
+                    waits.append((1 - self._request_allowance) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._token_allowance < tokens:
+                    waits.append((tokens - self._token_allowance) * 60 / self.tokens_per_minute)
+                if not waits:
+                    self._request_allowance -= 1
+                    self._token_allowance -= tokens
+                    return
+                wait = max(waits)
+            time.sleep(wait)
+
+
+def _status_code(error):
+    for attribute in ("status_code", "http_status", "status"):
+        code = getattr(error, attribute, None)
+        if isinstance(code, int):
+            return code
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _sdk_connection_errors():
+    """The Together SDK's connection and timeout errors, which subclass neither the requests nor the
+    builtin ones and carry no status code. Newer SDKs export them at the top level, older ones
+    from together.error."""
+    if together is None:
+        return ()
+    errors = set()
+    for module in (together, getattr(together, "error", None)):
+        for name in ("APIConnectionError", "APITimeoutError", "Timeout"):
+            error = getattr(module, name, None)
+            if isinstance(error, type) and issubclass(error, Exception):
+                errors.add(error)
+    return tuple(errors)
+
+
+CONNECTION_ERRORS = (requests.ConnectionError, requests.Timeout, TimeoutError, ConnectionError) + _sdk_connection_errors()
+
+
+def is_retryable(error):
+    if isinstance(error, CONNECTION_ERRORS):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def retry_with_backoff(func, *args, retries=MAX_RETRIES, **kwargs):
+    """Calls func, retrying 429/5xx and connection errors with exponential backoff and jitter."""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = _retry_after(e) or min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+            delay *= random.uniform(0.8, 1.2)
+            increment("retries", operation=getattr(func, "__name__", "call"), status=_status_code(e) or "error")
+            print(f"Retrying after error ({e}), attempt {attempt + 1}/{retries}, waiting {delay:.1f}s")  # Debugging
+            time.sleep(delay)
+
+
+def run_stages(jobs, stages, max_in_flight=MAX_JOBS_IN_FLIGHT):
+    """Pushes each job through the stages, each stage running on its own bounded thread pool.
+
+    stages is a list of (name, func, workers); func(job) updates the job dict in place and may set
+    job["done"] to skip the remaining stages. An exception marks the job done with job["error"].
+    Yields (index, job) in completion order as jobs leave the last stage; callers that need the
+    original order should place results by index. jobs may be a generator: a new job is only
+    started once fewer than max_in_flight jobs are between the first stage and the caller. Stage
+    functions run in a copy of the caller's context, so context variables set by the caller apply
+    to them.
+    """
+    context = contextvars.copy_context()
+    completed = queue.Queue()
+    executors = [ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) for name, _, workers in stages]
+
+    def submit(stage_index, index, job):
+        if stage_index == len(stages) or job.get("done"):
+            completed.put((index, job))
+            return
+        future = executors[stage_index].submit(context.copy().run, stages[stage_index][1], job)
+        future.add_done_callback(lambda f: advance(stage_index, index, job, f))
+
+    def advance(stage_index, index, job, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            job["error"] = f"{stages[stage_index][0]}: {error}"
+            job["done"] = True
+        try:
+            submit(stage_index + 1, index, job)
+        except RuntimeError:
+            # The run was abandoned and the next stage's pool already shut down
+            pass
+
+    max_in_flight = max_in_flight or 2 * sum(workers for _, _, workers in stages)
+    in_flight = 0
+    try:
+        for index, job in enumerate(jobs):
+            while in_flight >= max_in_flight:
+                yield completed.get()
+                in_flight -= 1
+            submit(0, index, job)
+            in_flight += 1
+        while in_flight:
+            yield completed.get()
+            in_flight -= 1
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
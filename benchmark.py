@@ -0,0 +1,372 @@
+"""Offline throughput benchmark for the batch pipeline.
+
+Generates a synthetic corpus of bill PDFs (with a text layer or scanned) and HTML bill pages,
+serves it from a local HTTP server, swaps the Together client for a stub model with configurable
+latency, runs the sheet pipeline over it and reports per-stage timings, pages/sec, bills/min and
+peak RSS. Nothing leaves the machine.
+
+    python benchmark.py --bills 20 --max-pages 300 --llm-latency 1.0
+
+With --ocr it instead compares the standard and adaptive OCR modes on scanned pages (with a
+line-number gutter and a slight skew, like real bill scans), reporting pages/sec and character
+accuracy against the generated text.
+
+    python benchmark.py --ocr --ocr-pages 20
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import difflib
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+from functools import partial
+from collections import defaultdict
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import fitz
+import pandas as pd
+from PIL import Image
+
+from cache import DiskCache
+from fetch import FetchClient
+from batch import RateLimiter
+from journal import BatchJournal
+from versions import BillVersionStore
+from workspace import Workspace
+from ocr import extract_text_from_pdf, pool_pids
+import pipeline
+
+WORDS = (
+    "the department shall provide funding for each fiscal year under this act including grants to counties "
+    "municipalities school districts and agencies subject to appropriation by the legislature pursuant to "
+    "section of the code as amended notwithstanding any other provision of law effective upon passage"
+).split()
+SECTION_HEADINGS = ("Definitions", "Appropriations", "Reporting requirements", "Grant program", "Penalties",
+                    "Severability", "Effective date", "Administration", "Eligibility", "Audit")
+SUMMARY_COLUMNS = ("Extractive Summary", "Abstractive Summary", "Highlights and Analysis")
+
+
+def make_bill_text(pages, rng):
+    """Returns one string per page of plausible-looking bill text with numbered sections."""
+    page_texts = []
+    section = 1
+    for _ in range(pages):
+        lines = []
+        while len(lines) < 40:
+            if rng.random() < 0.15:
+                lines.append(f"SECTION {section}. {rng.choice(SECTION_HEADINGS)}.")
+                section += 1
+            lines.append(" ".join(rng.choice(WORDS) for _ in range(12)))
+        page_texts.append("\n".join(lines))
+    return page_texts
+
+
+def make_text_pdf(path, page_texts, line_numbers=False):
+    """Writes one page per text; line_numbers adds a numbered, ruled left gutter as bills have."""
+    with fitz.open() as document:
+        for text in page_texts:
+            page = document.new_page()
+            page.insert_textbox(fitz.Rect(72, 54, page.rect.width - 54, page.rect.height - 54), text, fontsize=10)
+            if line_numbers:
+                page.draw_line((62, 48), (62, page.rect.height - 48))
+                for number, y in enumerate(range(64, int(page.rect.height) - 54, 14), start=1):
+                    page.insert_text((40, y), str(number), fontsize=8)
+        document.save(path)
+
+
+def make_scanned_pdf(path, page_texts, dpi=150, line_numbers=False, skew=0.0):
+    """Renders a text PDF to images, optionally rotated by skew degrees, and rebuilds it from them,
+    leaving no text layer."""
+    with tempfile.TemporaryDirectory() as folder:
+        text_path = os.path.join(folder, "text.pdf")
+        make_text_pdf(text_path, page_texts, line_numbers)
+        with fitz.open(text_path) as source, fitz.open() as document:
+            for source_page in source:
+                pixmap = source_page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+                stream = pixmap.tobytes("png")
+                if skew:
+                    image = Image.open(io.BytesIO(stream)).rotate(skew, fillcolor=255)
+                    buffer = io.BytesIO()
+                    image.save(buffer, "PNG")
+                    stream = buffer.getvalue()
+                page = document.new_page(width=source_page.rect.width, height=source_page.rect.height)
+                page.insert_image(page.rect, stream=stream)
+            document.save(path)
+
+
+def make_bill_page(path, page_texts):
+    body = "".join(f"<p>{line}</p>" for text in page_texts for line in text.splitlines())
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(
+            "<html><head><title>Bill</title><script>var tracking = 1;</script></head><body>"
+            "<nav><a href='/'>Home</a> <a href='/bills'>Bills</a> <a href='/members'>Members</a></nav>"
+            f"<main><h1>House Bill</h1>{body}</main>"
+            "<footer>Copyright Legislature. All rights reserved.</footer></body></html>"
+        )
+
+
+def build_corpus(folder, bills, max_pages, scanned_ratio, html_ratio, seed):
+    """Writes the corpus into folder and returns [(file_name, kind, pages, ground_truth_text)]."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(bills):
+        pages = rng.randint(1, max_pages)
+        page_texts = make_bill_text(pages, rng)
+        roll = rng.random()
+        if roll < html_ratio:
+            name, kind = f"bill_{i}.html", "html"
+            make_bill_page(os.path.join(folder, name), page_texts)
+        elif roll < html_ratio + scanned_ratio:
+            name, kind = f"bill_{i}_scanned.pdf", "scanned"
+            make_scanned_pdf(os.path.join(folder, name), page_texts)
+        else:
+            name, kind = f"bill_{i}.pdf", "text"
+            make_text_pdf(os.path.join(folder, name), page_texts)
+        corpus.append((name, kind, pages, "\n".join(page_texts)))
+    return corpus
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_folder(folder):
+    """Serves folder over HTTP on a free local port; returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=folder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class StubTogetherClient:
+    """Stands in for together.Together: waits `latency` seconds, then streams a canned summary."""
+
+    def __init__(self, latency=1.0, tokens_per_second=50.0, response_tokens=200):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.requests = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, stream=False, **kwargs):
+        prompt = messages[-1]["content"]
+        with self._lock:
+            self.requests += 1
+            self.prompt_chars += len(prompt)
+        time.sleep(self.latency)
+        return self._stream(prompt)
+
+    def _stream(self, prompt):
+        delay = 1 / self.tokens_per_second if self.tokens_per_second else 0
+        words = prompt.split()[-self.response_tokens:] or ["summary"]
+        for word in words:
+            time.sleep(delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+
+
+def peak_rss_mb():
+    """Returns the main process's peak RSS in MB, or None where unsupported."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is KB on Linux and bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+
+def private_memory_mb(pid):
+    """Returns the memory a process doesn't share, in MB, or None where /proc is unavailable.
+
+    Forked OCR workers share the parent's pages, so their RSS would mostly be the parent's.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            kb = sum(int(line.split()[1]) for line in f if line.startswith(("Private_Clean:", "Private_Dirty:")))
+    except (OSError, ValueError, IndexError):
+        return None
+    return kb / 1024
+
+
+class WorkerMemorySampler:
+    """Samples the live OCR workers' private memory on a background thread and keeps the largest
+    value seen; RUSAGE_CHILDREN only covers workers that have already exited."""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            for pid in pool_pids():
+                mb = private_memory_mb(pid)
+                if mb is not None and (self.peak_mb is None or mb > self.peak_mb):
+                    self.peak_mb = mb
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def timed_stage(stage, timings, name):
+    def run(job):
+        start = time.perf_counter()
+        try:
+            return stage(job)
+        finally:
+            timings[name].append(time.perf_counter() - start)
+    return run
+
+
+def run_benchmark(args):
+    work_folder = tempfile.mkdtemp(prefix="bill_benchmark_")
+    corpus_folder = os.path.join(work_folder, "corpus")
+    os.makedirs(corpus_folder)
+
+    start = time.perf_counter()
+    corpus = build_corpus(corpus_folder, args.bills, args.max_pages, args.scanned_ratio, args.html_ratio, args.seed)
+    corpus_seconds = time.perf_counter() - start
+    server, base_url = serve_folder(corpus_folder)
+
+    # Point every side effect of the pipeline at the scratch folder and the stub model
+    os.chdir(work_folder)
+    pipeline.client = StubTogetherClient(args.llm_latency, args.tokens_per_second)
+    pipeline.rate_limiter = RateLimiter(0, 0)
+    pipeline.cache = DiskCache(os.path.join(work_folder, "cache"), enabled=args.cache)
+    pipeline.fetch_client = FetchClient(pipeline.cache)
+    pipeline.journal = BatchJournal(os.path.join(work_folder, "journal.sqlite3"))
+    pipeline.versions = BillVersionStore(os.path.join(work_folder, "versions.sqlite3"))
+    pipeline.workspace = Workspace(os.path.join(work_folder, "workspace"))
+    tesseract = pipeline.pytesseract.pytesseract
+    if not os.path.exists(tesseract.tesseract_cmd):
+        # The default install path is Windows-only; fall back to tesseract on PATH
+        tesseract.tesseract_cmd = "tesseract"
+
+    timings = defaultdict(list)
+    for name in ("download_stage", "extract_stage", "summarize_stage"):
+        setattr(pipeline, name, timed_stage(getattr(pipeline, name), timings, name.replace("_stage", "")))
+
+    df = pd.DataFrame({
+        "BillState": ["XX"] * len(corpus),
+        "BillTextURL": [f"{base_url}/{name}" for name, _, _, _ in corpus],
+    })
+    start = time.perf_counter()
+    with WorkerMemorySampler() as worker_memory:
+        results = pipeline.summarize_sheet(df, f"benchmark-{time.time()}", download_workers=args.download_workers,
+                                           ocr_workers=args.ocr_workers, llm_workers=args.llm_workers)
+    wall_seconds = time.perf_counter() - start
+    server.shutdown()
+
+    pdf_pages = sum(pages for _, kind, pages, _ in corpus if kind != "html")
+    extract_seconds = sum(timings["extract"])
+    rss = peak_rss_mb()
+    report = {
+        "bills": len(corpus),
+        "pdf_pages": pdf_pages,
+        "kinds": {kind: sum(1 for _, k, _, _ in corpus if k == kind) for kind in ("text", "scanned", "html")},
+        "corpus_build_seconds": round(corpus_seconds, 2),
+        "wall_seconds": round(wall_seconds, 2),
+        "bills_per_minute": round(len(corpus) / wall_seconds * 60, 2) if wall_seconds else None,
+        "pages_per_second": round(pdf_pages / extract_seconds, 2) if extract_seconds else None,
+        "stages": {
+            name: {"total_seconds": round(sum(values), 2), "mean_seconds": round(sum(values) / len(values), 3),
+                   "max_seconds": round(max(values), 3), "calls": len(values)}
+            for name, values in timings.items() if values
+        },
+        "llm_requests": pipeline.client.requests,
+        "llm_prompt_tokens_estimate": pipeline.client.prompt_chars // 4,
+        # result_row() writes "" when a row never got summaries and "N/A" for a failed summary
+        "failed_rows": sum(1 for row in results
+                           if any(row[column] in ("", "N/A") for column in SUMMARY_COLUMNS)),
+        "peak_rss_mb": round(rss, 1) if rss else None,
+        # None if no page needed OCR, so no worker was started
+        "peak_ocr_worker_private_mb": round(worker_memory.peak_mb, 1) if worker_memory.peak_mb is not None else None,
+    }
+    return report
+
+
+def character_accuracy(text, ground_truth):
+    """Share of matching characters between OCR output and the true text, ignoring whitespace layout."""
+    text, ground_truth = " ".join(text.split()), " ".join(ground_truth.split())
+    if not ground_truth:
+        return 1.0 if not text else 0.0
+    return difflib.SequenceMatcher(None, text, ground_truth, autojunk=False).ratio()
+
+
+def run_ocr_benchmark(args):
+    """OCRs the same scanned bill with each OCR mode and reports speed and accuracy."""
+    work_folder = tempfile.mkdtemp(prefix="ocr_benchmark_")
+    page_texts = make_bill_text(args.ocr_pages, random.Random(args.seed))
+    pdf_path = os.path.join(work_folder, "scanned.pdf")
+    make_scanned_pdf(pdf_path, page_texts, dpi=args.scan_dpi, line_numbers=not args.no_line_numbers,
+                     skew=args.skew)
+    tesseract = pipeline.pytesseract.pytesseract
+    if not os.path.exists(tesseract.tesseract_cmd):
+        tesseract.tesseract_cmd = "tesseract"
+
+    report = {"pages": len(page_texts), "scan_dpi": args.scan_dpi, "skew_degrees": args.skew,
+              "line_numbers": not args.no_line_numbers, "modes": {}}
+    for mode in ("standard", "adaptive"):
+        start = time.perf_counter()
+        ocr_texts, failed_pages = extract_text_from_pdf(pdf_path, mode=mode)
+        seconds = time.perf_counter() - start
+        accuracies = [character_accuracy(text, truth) for text, truth in zip(ocr_texts, page_texts)]
+        report["modes"][mode] = {
+            "seconds": round(seconds, 2),
+            "pages_per_second": round(len(page_texts) / seconds, 2) if seconds else None,
+            "character_accuracy": round(sum(accuracies) / len(accuracies), 4) if accuracies else None,
+            "failed_pages": len(failed_pages),
+        }
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bill pipeline offline.")
+    parser.add_argument("--bills", type=int, default=20)
+    parser.add_argument("--max-pages", type=int, default=30, help="bills get 1..max-pages pages")
+    parser.add_argument("--scanned-ratio", type=float, default=0.3, help="share of bills that are image-only PDFs")
+    parser.add_argument("--html-ratio", type=float, default=0.2, help="share of bills that are HTML pages")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="stub model time to first token, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="stub model streaming rate")
+    parser.add_argument("--download-workers", type=int, default=pipeline.DOWNLOAD_WORKERS)
+    parser.add_argument("--ocr-workers", type=int, default=pipeline.OCR_WORKERS)
+    parser.add_argument("--llm-workers", type=int, default=pipeline.LLM_WORKERS)
+    parser.add_argument("--cache", action="store_true", help="enable the disk cache (off by default)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ocr", action="store_true", help="compare the standard and adaptive OCR modes instead")
+    parser.add_argument("--ocr-pages", type=int, default=10, help="scanned pages OCR'd by each mode")
+    parser.add_argument("--scan-dpi", type=int, default=200, help="resolution of the simulated scan")
+    parser.add_argument("--skew", type=float, default=1.0, help="rotation of the simulated scan, degrees")
+    parser.add_argument("--no-line-numbers", action="store_true", help="scan pages without a line-number gutter")
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.json:
+        args.json = os.path.abspath(args.json)  # run_benchmark changes into a scratch folder
+    report = run_ocr_benchmark(args) if args.ocr else run_benchmark(args)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
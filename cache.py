@@ -0,0 +1,161 @@
+import os
+import json
+import hashlib
+import contextvars
+import tempfile
+import threading
+
+from metrics import increment
+
+CACHE_FOLDER = os.getenv("SUMMARY_CACHE_DIR", ".cache")
+CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_MB", "1024")) * 1024 * 1024
+CACHE_ENABLED = os.getenv("SUMMARY_CACHE", "on").lower() not in ("0", "off", "false", "no")
+
+# Lets one caller, such as a Streamlit session, skip the cache without switching it off for everyone
+_use_cache = contextvars.ContextVar("use_cache", default=True)
+
+# Evict down to this fraction of the limit so we don't rescan the folder on every write
+EVICTION_TARGET = 0.9
+
+
+def set_cache_enabled(enabled):
+    """Turns the cache on or off for the current context only, including the threads it starts with
+    copy_context(); other sessions and running batches keep their own setting."""
+    _use_cache.set(enabled)
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_text(*parts):
+    return hash_bytes("\0".join(parts).encode("utf-8"))
+
+
+class DiskCache:
+    """Persistent content-addressed cache with size-bounded LRU eviction.
+
+    Entries live under folder/namespace/ab/abcdef..., where the key is a content hash.
+    Reads touch the file's mtime so eviction removes the least recently used entries first.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=CACHE_MAX_BYTES, enabled=CACHE_ENABLED):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, namespace, key):
+        return os.path.join(self.folder, namespace, key[:2], key)
+
+    def active(self):
+        return self.enabled and _use_cache.get()
+
+    def get_bytes(self, namespace, key):
+        if not self.active():
+            return None
+        path = self._path(namespace, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            increment("cache_lookups", namespace=namespace, result="miss")
+            return None
+        with self._lock:
+            self.hits += 1
+        increment("cache_lookups", namespace=namespace, result="hit")
+        return data
+
+    def set_bytes(self, namespace, key, data):
+        if not self.active():
+            return
+        path = self._path(namespace, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so concurrent readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing cache entry: {e}")  # Debugging
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            over_limit = self.size() > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def get(self, namespace, key):
+        data = self.get_bytes(namespace, key)
+        return json.loads(data) if data is not None else None
+
+    def set(self, namespace, key, value):
+        self.set_bytes(namespace, key, json.dumps(value).encode("utf-8"))
+
+    def _entries(self):
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def evict(self):
+        """Deletes least recently used entries until the cache is back under its size limit."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_TARGET
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._size = total
+
+    def clear(self):
+        for _, _, path in list(self._entries()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size_bytes": self.size() if self.enabled else 0,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,97 @@
+import os
+import re
+import math
+
+from summaries import SUMMARY_TIMEOUT, run_concurrently
+
+# Largest input, in estimated tokens, sent to the model in one request
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", 12000))
+MAP_WORKERS = int(os.getenv("MAP_WORKERS", 8))
+CHARS_PER_TOKEN = 4
+
+# Bill section boundaries: "SECTION 1.", "Sec. 2.", "§ 3", "ARTICLE IV", "PART 2", "TITLE I"
+SECTION_PATTERN = re.compile(
+    r"^[ \t]*(?:SECTION|Section|SEC\.|Sec\.|§+|ARTICLE|Article|PART|Part|TITLE|Title|CHAPTER|Chapter)"
+    r"[ \t]*[0-9IVXLC]+[A-Za-z0-9.\-]*",
+    re.MULTILINE,
+)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_sections(text):
+    """Splits text at section headings; any preamble before the first heading is its own section."""
+    starts = [match.start() for match in SECTION_PATTERN.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)]) if text[start:end].strip()]
+
+
+def _split_oversized(text, max_tokens):
+    """Splits a single section that is over budget on paragraph, then line, then character boundaries."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    for separator in ("\n\n", "\n"):
+        parts = [part + separator for part in text.split(separator)]
+        if len(parts) > 1 and all(len(part) <= max_chars for part in parts):
+            return parts
+    return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+
+def split_into_chunks(text, max_tokens=CHUNK_TOKEN_BUDGET):
+    """Packs whole sections into chunks of at most max_tokens, only splitting sections that don't fit alone."""
+    chunks = []
+    current = ""
+    for section in split_sections(text):
+        pieces = [section] if estimate_tokens(section) <= max_tokens else _split_oversized(section, max_tokens)
+        for piece in pieces:
+            if current and estimate_tokens(current + piece) > max_tokens:
+                chunks.append(current)
+                current = ""
+            current += piece
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def build_chunk_prompt(chunk, part, total_parts):
+    return (
+        f"The following is part {part} of {total_parts} of a legislative bill. Summarize it in detail, keeping "
+        "section numbers and headings, the key provisions, amounts, dates, deadlines and the agencies or "
+        "parties affected. Write only the summary.\n\n"
+        f"{chunk}"
+    )
+
+
+def condense_text(text, complete, max_tokens=CHUNK_TOKEN_BUDGET, max_workers=MAP_WORKERS):
+    """Map step of map-reduce summarization for text that exceeds the token budget.
+
+    Splits the text on section boundaries, summarizes the chunks concurrently with
+    complete(prompt), and joins the partial summaries in order, repeating until the result fits
+    in one request. Text that already fits is returned unchanged. Returns (text, errors); when
+    errors is not empty the text is missing the failed parts and should not be summarized.
+    """
+    errors = {}
+    while estimate_tokens(text) > max_tokens:
+        chunks = split_into_chunks(text, max_tokens)
+        print(f"Summarizing {len(chunks)} chunks of a {estimate_tokens(text)}-token text")  # Debugging
+        tasks = {
+            f"part {i + 1}": (lambda prompt=build_chunk_prompt(chunk, i + 1, len(chunks)): complete(prompt))
+            for i, chunk in enumerate(chunks)
+        }
+        # Chunks queue behind max_workers, so the deadline covers one request per round of workers
+        timeout = SUMMARY_TIMEOUT * math.ceil(len(tasks) / max_workers)
+        results, failures = run_concurrently(tasks, timeout=timeout, max_workers=max_workers)
+        for name in tasks:
+            if name in results and not results[name]:
+                failures[name] = "empty response"
+        errors.update(failures)
+        if failures:
+            break
+        condensed = "\n\n".join(results[name] for name in tasks if results.get(name))
+        # Stop if the model isn't shrinking the text rather than looping forever
+        if not condensed or len(condensed) >= len(text):
+            break
+        text = condensed
+    return text, errors
@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache import hash_bytes, hash_text
+from metrics import increment, span
+
+FETCH_TIMEOUT = (float(os.getenv("FETCH_CONNECT_TIMEOUT", 10)), float(os.getenv("FETCH_READ_TIMEOUT", 60)))
+# State legislature sites throttle aggressive clients, so cap simultaneous requests per host
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("FETCH_MAX_PER_HOST", 4))
+USER_AGENT = "Stateside-Bill-Summarization/1.0"
+
+FetchResult = namedtuple("FetchResult", ["content", "content_type", "from_cache"])
+
+
+class FetchClient:
+    """Shared HTTP client with pooled keep-alive connections, timeouts and a per-host concurrency cap.
+
+    Given a DiskCache, responses carrying an ETag or Last-Modified header are stored and later
+    revalidated with a conditional GET, so unchanged documents come back as a 304 with no body.
+    """
+
+    def __init__(self, cache=None, max_per_host=MAX_CONNECTIONS_PER_HOST, timeout=FETCH_TIMEOUT):
+        self.cache = cache
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                        allowed_methods=["GET"], respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max_per_host, max_retries=retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    def fetch(self, url):
+        """GETs url and returns a FetchResult, raising requests exceptions on failure."""
+        key = hash_text(url)
+        entry = self.cache.get("http", key) if self.cache else None
+        body = self.cache.get_bytes("http_body", entry["sha256"]) if entry else None
+
+        headers = {}
+        if body is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with span("fetch", url=url, host=urlsplit(url).netloc) as attributes:
+            with self._host_slot(url):
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            attributes["status_code"] = response.status_code
+
+            if response.status_code == 304 and body is not None:
+                print(f"Not modified, using stored copy of {url}")  # Debugging
+                attributes["not_modified"] = True
+                increment("fetch_not_modified")
+                return FetchResult(body, entry["content_type"], True)
+            response.raise_for_status()
+
+            content = response.content
+            attributes["bytes"] = len(content)
+            increment("fetch_bytes", len(content))
+        content_type = response.headers.get("Content-Type", "")
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        # Without a validator the server gives us no way to revalidate, so don't keep a copy
+        if self.cache and (etag or last_modified):
+            content_hash = hash_bytes(content)
+            self.cache.set_bytes("http_body", content_hash, content)
+            self.cache.set("http", key, {
+                "sha256": content_hash,
+                "content_type": content_type,
+                "etag": etag,
+                "last_modified": last_modified,
+            })
+        return FetchResult(content, content_type, False)
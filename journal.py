@@ -0,0 +1,64 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+JOURNAL_PATH = os.getenv("BATCH_JOURNAL", "batch_journal.sqlite3")
+
+
+class BatchJournal:
+    """SQLite journal of finished batch rows so an interrupted sheet can resume where it stopped.
+
+    Rows are keyed by the sheet's content hash and the row's position in the sheet, so
+    re-uploading the same file picks up its completed rows and a changed file starts fresh.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        # Opened on first use, so importing the pipeline doesn't create the file; callers hold _lock
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            with self._connection:
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS batch_rows ("
+                    "sheet_id TEXT NOT NULL, row_index INTEGER NOT NULL, result TEXT NOT NULL, "
+                    "completed_at REAL NOT NULL, PRIMARY KEY (sheet_id, row_index))"
+                )
+        return self._connection
+
+    def completed_row_indexes(self, sheet_id):
+        """Returns the set of finished row indexes without loading their results."""
+        with self._lock:
+            cursor = self._connect().execute("SELECT row_index FROM batch_rows WHERE sheet_id = ?", (sheet_id,))
+            return {row_index for row_index, in cursor}
+
+    def result(self, sheet_id, row_index):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT result FROM batch_rows WHERE sheet_id = ? AND row_index = ?", (sheet_id, row_index)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def record(self, sheet_id, row_index, result):
+        # Commit per row so a crash loses at most the rows still in flight
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO batch_rows (sheet_id, row_index, result, completed_at) VALUES (?, ?, ?, ?)",
+                (sheet_id, row_index, json.dumps(result, default=str), time.time()),
+            )
+
+    def clear(self, sheet_id):
+        with self._lock, self._connect() as connection:
+            connection.execute("DELETE FROM batch_rows WHERE sheet_id = ?", (sheet_id,))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
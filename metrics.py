@@ -0,0 +1,154 @@
+"""Per-stage timing and resource instrumentation for the pipeline.
+
+Stages are timed with span(); each finished span is aggregated for the Prometheus-style text
+exposition from render_prometheus(), logged as one JSON line on the "pipeline.metrics" logger,
+and added to the per-bill breakdown of any bill_timings() block it runs inside.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+
+LOG_LEVEL = os.getenv("METRICS_LOG_LEVEL", "INFO").upper()
+
+logger = logging.getLogger("pipeline.metrics")
+
+_lock = threading.Lock()
+_durations = defaultdict(lambda: [0, 0.0, 0.0])  # (stage, status) -> [count, sum, max]
+_counters = defaultdict(float)  # (name, sorted label items) -> value
+_bill_timings = contextvars.ContextVar("bill_timings", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": round(record.created, 3), "level": record.levelname, "event": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+def _configure_logger():
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+_configure_logger()
+
+
+def increment(name, amount=1, **labels):
+    """Adds amount to the counter name{labels}."""
+    with _lock:
+        _counters[(name, tuple(sorted((key, str(value)) for key, value in labels.items())))] += amount
+
+
+def record(stage, seconds, status="ok", log=True, **attributes):
+    """Records one finished stage execution; per-page stages pass log=False to keep logs readable."""
+    with _lock:
+        aggregate = _durations[(stage, status)]
+        aggregate[0] += 1
+        aggregate[1] += seconds
+        aggregate[2] = max(aggregate[2], seconds)
+    timings = _bill_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+    if log:
+        logger.info("span", extra={"fields": {"stage": stage, "status": status,
+                                              "duration_ms": round(seconds * 1000, 1), **attributes}})
+
+
+@contextmanager
+def span(stage, **attributes):
+    """Times the enclosed block as one execution of stage.
+
+    Yields the attribute dict so the block can attach counts (bytes, pages, tokens, ...). Setting
+    attributes["error"], or an exception escaping the block, marks the span as failed.
+    """
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except Exception as e:
+        attributes.setdefault("error", str(e))
+        raise
+    finally:
+        status = "error" if attributes.get("error") else "ok"
+        if status == "error":
+            increment("failures", stage=stage)
+        record(stage, time.perf_counter() - start, status, **attributes)
+
+
+class BillTimings:
+    """Accumulated seconds per stage for one bill; safe to add to from several threads."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {stage: round(seconds, 3) for stage, seconds in self.stages.items()}
+
+
+@contextmanager
+def bill_timings(timings=None):
+    """Collects the spans recorded inside the block (including threads started with
+    copy_context()) into a BillTimings, which it yields."""
+    timings = timings or BillTimings()
+    token = _bill_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _bill_timings.reset(token)
+
+
+def snapshot():
+    with _lock:
+        durations = {key: list(value) for key, value in _durations.items()}
+        counters = dict(_counters)
+    return durations, counters
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(items):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in items)
+
+
+def render_prometheus():
+    """Returns all metrics in the Prometheus text exposition format."""
+    durations, counters = snapshot()
+    lines = [
+        "# HELP pipeline_stage_duration_seconds Time spent in each pipeline stage.",
+        "# TYPE pipeline_stage_duration_seconds summary",
+    ]
+    for (stage, status), (count, total, _) in sorted(durations.items()):
+        labels = _labels([("stage", stage), ("status", status)])
+        lines.append(f"pipeline_stage_duration_seconds_count{{{labels}}} {count}")
+        lines.append(f"pipeline_stage_duration_seconds_sum{{{labels}}} {total:.6f}")
+    lines.append("# HELP pipeline_stage_duration_seconds_max Slowest single execution of each stage.")
+    lines.append("# TYPE pipeline_stage_duration_seconds_max gauge")
+    for (stage, status), (_, _, longest) in sorted(durations.items()):
+        lines.append(f"pipeline_stage_duration_seconds_max{{{_labels([('stage', stage), ('status', status)])}}} "
+                     f"{longest:.6f}")
+    names = sorted({name for name, _ in counters})
+    for name in names:
+        lines.append(f"# TYPE pipeline_{name}_total counter")
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                suffix = f"{{{_labels(labels)}}}" if labels else ""
+                lines.append(f"pipeline_{name}_total{suffix} {value:g}")
+    return "\n".join(lines) + "\n"
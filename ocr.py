@@ -0,0 +1,385 @@
+import os
+import time
+import atexit
+import threading
+import unicodedata
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz
+import pytesseract
+from PIL import Image
+from pdf2image import convert_from_bytes, convert_from_path, pdfinfo_from_bytes, pdfinfo_from_path
+
+from cache import hash_bytes, hash_file, hash_text
+from metrics import increment, record
+from preprocess import preprocess_page
+
+OCR_CONFIG = '--psm 6'
+OCR_DPI = int(os.getenv("OCR_DPI", 200))
+# "standard" OCRs the page as rendered; "adaptive" picks the DPI per page, cleans the image up
+# (binarize, deskew, crop margins and line-number gutters) and runs Tesseract with ADAPTIVE_OCR_CONFIG
+OCR_MODE = os.getenv("OCR_MODE", "standard")
+# LSTM engine only, and skip the second pass that looks for white-on-black text bills never have
+ADAPTIVE_OCR_CONFIG = '--oem 1 --psm 6 -c tessedit_do_invert=0'
+ADAPTIVE_MIN_DPI = 150
+ADAPTIVE_MAX_DPI = 300
+# Capital letters this many pixels tall are where Tesseract is both fast and accurate
+TARGET_CAP_HEIGHT_PX = 24
+CAP_HEIGHT_RATIO = 0.7  # Cap height as a share of the font size for typical bill typefaces
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "on").lower() not in ("0", "off", "false", "no")
+# Pages rasterized ahead of OCR per worker; bounds how many page bitmaps are held in memory at once
+PAGES_IN_FLIGHT_PER_WORKER = 2
+
+# A text layer shorter than this is only trusted when the page has no images to OCR instead
+MIN_TEXT_LAYER_CHARS = 50
+# Broken font encodings produce text layers that are mostly symbols or replacement characters
+MIN_READABLE_RATIO = 0.85
+READABLE_PUNCTUATION = set(".,;:!?()[]{}-'\"/&%$#@*+=<>_\u00a7\u2018\u2019\u201c\u201d\u2013\u2014")
+
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+# PyMuPDF isn't thread-safe, and batch runs extract several documents at once
+_fitz_lock = threading.Lock()
+
+
+def default_worker_count():
+    return max(1, os.cpu_count() or 1)
+
+
+def _init_worker(tesseract_cmd):
+    # Each worker already owns a core, so keep Tesseract's own OpenMP threads from oversubscribing the machine
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+
+def extract_text_from_image(image, config=OCR_CONFIG):
+    return pytesseract.image_to_string(image, config=config)
+
+
+def _ocr_page(page_number, image, config, preprocess=False):
+    """Runs in a pool worker; returns (page_number, text, error, seconds)."""
+    if image is None:
+        return page_number, "", "rasterization failed", 0.0
+    start = time.perf_counter()
+    try:
+        if preprocess:
+            image = preprocess_page(image)
+        return page_number, extract_text_from_image(image, config), None, time.perf_counter() - start
+    except Exception as e:
+        return page_number, "", str(e), time.perf_counter() - start
+
+
+def _get_pool(max_workers):
+    """Returns a process pool shared across documents so workers are not respawned for every bill."""
+    global _pool, _pool_key
+    key = (max_workers, pytesseract.pytesseract.tesseract_cmd)
+    # Batch runs extract several documents at once, so only one thread may (re)create the pool
+    with _pool_lock:
+        if _pool is None or _pool_key != key:
+            shutdown_pool()
+            _pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(key[1],))
+            _pool_key = key
+        return _pool
+
+
+def shutdown_pool():
+    global _pool, _pool_key
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+    _pool_key = None
+
+
+atexit.register(shutdown_pool)
+
+
+def pool_pids():
+    """Returns the process ids of the live OCR workers, for resource monitoring."""
+    with _pool_lock:
+        pool = _pool
+    return list(getattr(pool, "_processes", None) or {}) if pool is not None else []
+
+
+def _result(future, page_number):
+    try:
+        return future.result()
+    except Exception as e:
+        # A crashed worker breaks the pool; drop it so the next document gets a fresh one
+        if isinstance(e, BrokenProcessPool):
+            shutdown_pool()
+        return page_number, "", str(e), 0.0
+
+
+def _run_in_pool(page_images, max_workers, config, preprocess):
+    """OCRs pages as they are rasterized, keeping only a small window of pages in flight."""
+    window = max_workers * PAGES_IN_FLIGHT_PER_WORKER
+    pending = {}
+    for page_number, image in page_images:
+        if len(pending) >= window:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield _result(future, pending.pop(future))
+        try:
+            pending[_get_pool(max_workers).submit(_ocr_page, page_number, image, config, preprocess)] = page_number
+        except BrokenProcessPool as e:
+            shutdown_pool()
+            yield page_number, "", str(e), 0.0
+
+    for future in as_completed(pending):
+        yield _result(future, pending[future])
+
+
+def extract_text_from_images(page_images, total, max_workers=None, progress_callback=None, config=OCR_CONFIG,
+                             preprocess=False):
+    """OCRs (page_number, image) pairs in parallel and returns ({page_number: text}, failed_pages).
+
+    page_images may be a generator; pages are pulled from it only as workers free up, so memory
+    stays flat however long the document is. A page that fails to OCR contributes "" and is listed
+    in failed_pages as (page_number, error) instead of aborting the document.
+    progress_callback(done, total) is called as pages finish. With preprocess, each page is
+    cleaned up with preprocess.preprocess_page in the worker before OCR.
+    """
+    page_texts = {}
+    failed_pages = []
+    max_workers = max_workers or default_worker_count()
+
+    if max_workers == 1 or total == 1:
+        results = (_ocr_page(page_number, image, config, preprocess) for page_number, image in page_images)
+    else:
+        results = _run_in_pool(page_images, max_workers, config, preprocess)
+
+    done = 0
+    for page_number, text, error, seconds in results:
+        page_texts[page_number] = text
+        record("ocr_page", seconds, "error" if error else "ok", log=False)
+        if error:
+            print(f"OCR failed on page {page_number}: {error}")  # Debugging
+            failed_pages.append((page_number, error))
+        done += 1
+        if progress_callback:
+            progress_callback(done, total)
+
+    failed_pages.sort()
+    return page_texts, failed_pages
+
+
+def _is_pdf_bytes(pdf):
+    return isinstance(pdf, (bytes, bytearray))
+
+
+def pdf_label(pdf):
+    """Names a PDF given as a path or as bytes, for log messages."""
+    return f"in-memory PDF ({len(pdf):,} bytes)" if _is_pdf_bytes(pdf) else os.path.basename(pdf)
+
+
+def _open_pdf(pdf):
+    return fitz.open(stream=pdf, filetype="pdf") if _is_pdf_bytes(pdf) else fitz.open(pdf)
+
+
+def _pdfinfo(pdf, poppler_path):
+    if _is_pdf_bytes(pdf):
+        return pdfinfo_from_bytes(pdf, poppler_path=poppler_path)
+    return pdfinfo_from_path(pdf, poppler_path=poppler_path)
+
+
+def _render_page(page, dpi, grayscale):
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=colorspace, alpha=False)
+    return Image.frombytes("L" if grayscale else "RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def choose_dpi(page):
+    """Picks the rasterization DPI for one page in adaptive mode.
+
+    A scan is rendered at its embedded image's own resolution, since rendering above it adds
+    pixels but no detail. A page drawn as text is rendered so its body text comes out about
+    TARGET_CAP_HEIGHT_PX tall. Either way the result is kept between ADAPTIVE_MIN_DPI and ADAPTIVE_MAX_DPI.
+    """
+    dpi = None
+    images = [info for info in page.get_image_info() if fitz.Rect(info["bbox"]).width > 0]
+    if images:
+        largest = max(images, key=lambda info: abs(fitz.Rect(info["bbox"])))
+        dpi = largest["width"] / (fitz.Rect(largest["bbox"]).width / 72)
+    else:
+        sizes = sorted(span["size"] for block in page.get_text("dict")["blocks"]
+                       for line in block.get("lines", []) for span in line["spans"] if span["text"].strip())
+        if sizes:
+            dpi = TARGET_CAP_HEIGHT_PX * 72 / (CAP_HEIGHT_RATIO * sizes[len(sizes) // 2])
+    if dpi is None:
+        return OCR_DPI
+    return int(min(max(dpi, ADAPTIVE_MIN_DPI), ADAPTIVE_MAX_DPI))
+
+
+def iter_page_images(pdf_path, pages=None, dpi=OCR_DPI, grayscale=OCR_GRAYSCALE, poppler_path=None):
+    """Rasterizes the given 1-based pages (all pages by default) one at a time, yielding (page_number, image).
+
+    pdf_path may also be the PDF's bytes. Pages are rendered in memory with PyMuPDF, falling back
+    to poppler for files PyMuPDF can't open.
+    With dpi=None each page's DPI is picked by choose_dpi. A page that fails to render is yielded
+    with image None.
+    """
+    try:
+        with _fitz_lock:
+            document = _open_pdf(pdf_path)
+    except Exception as e:
+        print(f"PyMuPDF could not open {pdf_label(pdf_path)} ({e}), rasterizing with poppler")  # Debugging
+        yield from _iter_page_images_poppler(pdf_path, pages, dpi or OCR_DPI, grayscale, poppler_path)
+        return
+
+    try:
+        for page_number in pages or range(1, document.page_count + 1):
+            start = time.perf_counter()
+            try:
+                with _fitz_lock:
+                    page = document[page_number - 1]
+                    image = _render_page(page, dpi or choose_dpi(page), grayscale)
+            except Exception as e:
+                print(f"Error rasterizing page {page_number}: {e}")  # Debugging
+                image = None
+            record("rasterize", time.perf_counter() - start, "error" if image is None else "ok", log=False)
+            yield page_number, image
+    finally:
+        with _fitz_lock:
+            document.close()
+
+
+def _iter_page_images_poppler(pdf_path, pages, dpi, grayscale, poppler_path):
+    if pages is None:
+        try:
+            pages = range(1, _pdfinfo(pdf_path, poppler_path)["Pages"] + 1)
+        except Exception as e:
+            print(f"Error reading PDF info: {e}")  # Debugging
+            return
+    for page_number in pages:
+        start = time.perf_counter()
+        try:
+            convert = convert_from_bytes if _is_pdf_bytes(pdf_path) else convert_from_path
+            image = convert(pdf_path, dpi=dpi, grayscale=grayscale, first_page=page_number,
+                            last_page=page_number, poppler_path=poppler_path)[0]
+        except Exception as e:
+            print(f"Error rasterizing page {page_number}: {e}")  # Debugging
+            image = None
+        record("rasterize", time.perf_counter() - start, "error" if image is None else "ok", log=False)
+        yield page_number, image
+
+
+def count_pages(pdf_path, poppler_path=None):
+    try:
+        with _fitz_lock, _open_pdf(pdf_path) as document:
+            return document.page_count
+    except Exception:
+        try:
+            return _pdfinfo(pdf_path, poppler_path)["Pages"]
+        except Exception as e:
+            print(f"Error reading PDF info: {e}")  # Debugging
+            return 0
+
+
+def is_garbage_text(text):
+    characters = "".join(text.split())
+    if not characters:
+        return False
+    # Letters, digits and combining marks, so Devanagari vowel signs and the like count as readable
+    readable = sum(1 for ch in characters if unicodedata.category(ch)[0] in "LMN" or ch in READABLE_PUNCTUATION)
+    return readable / len(characters) < MIN_READABLE_RATIO
+
+
+def _page_needs_ocr(page, text):
+    if is_garbage_text(text):
+        return True
+    if len(text.strip()) >= MIN_TEXT_LAYER_CHARS:
+        return False
+    # Little or no text layer: only worth OCR if something on the page is drawn as an image (scans)
+    return bool(page.get_images())
+
+
+def read_text_layer(pdf_path):
+    """Returns (page_texts, ocr_pages) from the PDF's embedded text layer, or (None, None) if it can't be read.
+
+    ocr_pages lists the 1-based pages whose text layer is empty or unreadable and need OCR instead.
+    """
+    try:
+        with _fitz_lock, _open_pdf(pdf_path) as document:
+            page_texts = []
+            ocr_pages = []
+            for page in document:
+                text = page.get_text("text")
+                if _page_needs_ocr(page, text):
+                    ocr_pages.append(page.number + 1)
+                page_texts.append(text)
+            return page_texts, ocr_pages
+    except Exception as e:
+        print(f"Error reading text layer: {e}")  # Debugging
+        return None, None
+
+
+def extract_text_from_pdf(pdf_path, poppler_path=None, progress_callback=None, cache=None, mode=None):
+    """Returns (page_texts, failed_pages) for a PDF.
+
+    Pages with a usable embedded text layer are read directly; only the remaining pages are
+    rasterized and OCR'd, the "standard" or "adaptive" way (OCR_MODE by default).
+    progress_callback(done, total) counts pages across both paths.
+    When a DiskCache is given, results are cached by the PDF's content hash.
+    pdf_path may also be the PDF's bytes, as handed out by an in-memory Workspace.
+    """
+    mode = mode or OCR_MODE
+    pdf_hash = None
+    if cache and cache.active():
+        if _is_pdf_bytes(pdf_path):
+            pdf_hash = hash_bytes(pdf_path)
+        elif os.path.exists(pdf_path):
+            pdf_hash = hash_file(pdf_path)
+    if pdf_hash and mode != "standard":
+        pdf_hash = hash_text(pdf_hash, mode)
+    if pdf_hash:
+        page_texts = cache.get("pdf_text", pdf_hash)
+        if page_texts is not None:
+            print(f"Using cached text for {pdf_label(pdf_path)}")  # Debugging
+            increment("pages", len(page_texts), source="cache")
+            if progress_callback and page_texts:
+                progress_callback(len(page_texts), len(page_texts))
+            return page_texts, []
+
+    page_texts, failed_pages = _extract_text_from_pdf(pdf_path, poppler_path, progress_callback, mode)
+    # Don't cache partial results, so failed pages get another chance next time
+    if pdf_hash and page_texts and not failed_pages:
+        cache.set("pdf_text", pdf_hash, page_texts)
+    return page_texts, failed_pages
+
+
+def _extract_text_from_pdf(pdf_path, poppler_path, progress_callback, mode):
+    page_texts, ocr_pages = read_text_layer(pdf_path)
+    if page_texts is None:
+        total = count_pages(pdf_path, poppler_path)
+        page_texts = [""] * total
+        ocr_pages = list(range(1, total + 1))
+
+    total = len(page_texts)
+    text_layer_pages = total - len(ocr_pages)
+    print(f"Read {text_layer_pages}/{total} pages from the text layer, {len(ocr_pages)} need OCR")  # Debugging
+    increment("pages", text_layer_pages, source="text_layer")
+    increment("pages", len(ocr_pages), source="ocr")
+
+    if not ocr_pages:
+        if progress_callback and total:
+            progress_callback(total, total)
+        return page_texts, []
+
+    def report_progress(done, _):
+        progress_callback(text_layer_pages + done, total)
+
+    adaptive = mode == "adaptive"
+    page_images = iter_page_images(pdf_path, pages=ocr_pages, dpi=None if adaptive else OCR_DPI,
+                                   grayscale=adaptive or OCR_GRAYSCALE, poppler_path=poppler_path)
+    ocr_texts, failed_pages = extract_text_from_images(
+        page_images, len(ocr_pages), progress_callback=report_progress if progress_callback else None,
+        config=ADAPTIVE_OCR_CONFIG if adaptive else OCR_CONFIG, preprocess=adaptive
+    )
+    failed = dict(failed_pages)
+    for page_number, text in ocr_texts.items():
+        # On failure keep whatever the text layer had for the page rather than nothing
+        if text or page_number not in failed:
+            page_texts[page_number - 1] = text
+    return page_texts, failed_pages
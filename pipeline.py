@@ -0,0 +1,490 @@
+import os
+import time
+import pandas as pd
+import pytesseract
+from dotenv import load_dotenv
+from together import Together
+from ocr import extract_text_from_pdf, pdf_label
+from cache import DiskCache, hash_text
+from fetch import FetchClient
+from journal import BatchJournal
+from batch import DOWNLOAD_WORKERS, LLM_WORKERS, OCR_WORKERS, RateLimiter, retry_with_backoff, run_stages
+from chunking import CHUNK_TOKEN_BUDGET, condense_text, estimate_tokens
+from sheets import SheetReader
+from versions import (
+    VERSION_MAX_CHANGED_SHARE, VERSION_TRACKING, BillVersionStore, bill_key, diff_sections, format_changes,
+    section_hashes
+)
+from webtext import extract_main_text
+from workspace import Workspace
+from metrics import BillTimings, bill_timings, increment, record, span
+from summaries import SECTION_NAMES, SUMMARY_MODE, build_combined_prompt, parse_combined_response, run_concurrently
+
+load_dotenv()
+together_api_key = os.getenv("TOGETHER_AI_API_KEY")
+client = None  # Created on first use, so the pipeline can be imported without an API key
+MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
+
+cache = DiskCache()
+fetch_client = FetchClient(cache)
+rate_limiter = RateLimiter()
+journal = BatchJournal()
+versions = BillVersionStore()
+workspace = Workspace()
+
+pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD", r'C:\Program Files\Tesseract-OCR\tesseract.exe')
+POPPLER_PATH = os.getenv("POPPLER_PATH", r"C:\\Release-24.08.0-0\\poppler-24.08.0\\Library\\bin")
+
+
+def clean_summary(text):
+    """Cleans the summary by removing instructions and markdown-style bold formatting."""
+    if not text:
+        return ""
+
+    # List of instruction phrases to remove
+    instruction_phrases = [
+        "Here is a 2-paragraph extractive summary of the text:",
+        "Here is a 2-paragraph abstractive summary of the provided text:",
+        "Here are the highlights in 15-20 bullet points under 4 headings:",
+        "Here is a 2-paragraph abstractive summary of the text:"
+    ]
+
+    # Remove instruction phrases at the beginning
+    for phrase in instruction_phrases:
+        if text.startswith(phrase):
+            text = text[len(phrase):].lstrip()
+
+    # Remove markdown-like bold formatting (**text**)
+    text = text.replace("**", "").replace("### ", "")
+
+    return text.strip()
+
+
+
+def download_pdf_from_url(url):
+    """Downloads the PDF at url into the workspace and returns its path (its bytes in memory mode), or None.
+
+    The file is kept from eviction until workspace.release() is called on the path.
+    """
+    with span("download", url=url) as attributes:
+        try:
+            result = fetch_client.fetch(url)
+            content_type = result.content_type
+            attributes.update(bytes=len(result.content), from_cache=result.from_cache)
+
+            print(f"Downloading {url}, Content-Type: {content_type}")  # Debugging
+
+            if "application/pdf" not in content_type and not url.lower().endswith(".pdf"):
+                print(f"Skipping non-PDF URL: {url}")
+                attributes["error"] = f"not a PDF ({content_type})"
+                return None
+
+            # Named by content hash, so bills sharing a file name never overwrite each other
+            pdf_path = workspace.store(result.content)
+            print(f"PDF saved as {pdf_label(pdf_path)}")  # Debugging
+            return pdf_path
+        except Exception as e:
+            print(f"Error downloading PDF: {e}")  # Debugging
+            attributes["error"] = str(e)
+            return None
+
+
+def extract_pdf_text(pdf_path, progress_callback=None, failed_pages=None):
+    """Reads the PDF's text layer, OCRs only the pages without one, and returns (text, num_pages).
+
+    Pages that could not be extracted are appended to failed_pages as (page, error) if given.
+    """
+    with span("extract", pdf=pdf_label(pdf_path)) as attributes:
+        page_texts, failures = extract_text_from_pdf(
+            pdf_path, poppler_path=POPPLER_PATH, progress_callback=progress_callback, cache=cache
+        )
+        attributes.update(pages=len(page_texts), failed_pages=len(failures))
+        if not page_texts:
+            attributes["error"] = "no pages extracted"
+    if failures:
+        print(f"OCR failed on page(s) {', '.join(str(page) for page, _ in failures)} of {pdf_label(pdf_path)}")  # Debugging
+        if failed_pages is not None:
+            failed_pages.extend(failures)
+    return "".join(page_texts), len(page_texts)
+
+def extract_text_from_webpage(url, stats=None):
+    """Returns the main text of the page at url, or "" on failure.
+
+    If a stats dict is given, it is filled with the token estimates from webtext.extract_main_text.
+    """
+    with span("webpage", url=url) as attributes:
+        try:
+            result = fetch_client.fetch(url)
+            text, page_stats = extract_main_text(result.content)
+            attributes.update(bytes=len(result.content), chars=len(text), **page_stats)
+            increment("webpage_tokens_saved", page_stats["saved_tokens"])
+            print(f"Webpage {url}: {page_stats['tokens']} tokens instead of {page_stats['full_tokens']}")  # Debugging
+            if stats is not None:
+                stats.update(page_stats)
+            return text
+        except Exception as e:
+            attributes["error"] = str(e)
+            return ""
+
+def together_client():
+    global client
+    if client is None:
+        # retry_with_backoff does the retrying; the client's own retries would multiply with it
+        client = Together(api_key=together_api_key, max_retries=0)
+    return client
+
+
+def stream_completion(prompt, on_text=None):
+    """Streams the completion for prompt, calling on_text(text_so_far) as tokens arrive."""
+    # Roughly 4 characters per token is close enough for rate limiting
+    start = time.perf_counter()
+    rate_limiter.acquire(len(prompt) // 4)
+    record("rate_limit_wait", time.perf_counter() - start, log=False)
+    response = together_client().chat.completions.create(
+        model=MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True
+    )
+    result = ""
+    if on_text:
+        on_text(result)  # A retried request starts its text over
+    for token in response:
+        if hasattr(token, 'choices'):
+            content = token.choices[0].delta.content or ""
+            result += content
+            if on_text and content:
+                on_text(result)
+    return result
+
+
+def request_together_ai(prompt, on_text=None):
+    """Returns the raw Together AI completion for a prompt, raising on failure.
+
+    on_text(text_so_far) is called as the completion streams in, or once with a cached response.
+    """
+    cache_key = hash_text(MODEL, prompt)
+    prompt_tokens = len(prompt) // 4
+    with span("llm", model=MODEL, prompt_tokens=prompt_tokens) as attributes:
+        cached = cache.get("summary", cache_key)
+        attributes["cached"] = cached is not None
+        if cached is not None:
+            if on_text:
+                on_text(cached)
+            return cached
+        result = retry_with_backoff(stream_completion, prompt, on_text=on_text)
+        attributes["completion_tokens"] = len(result) // 4
+        increment("llm_tokens", prompt_tokens, kind="prompt")
+        increment("llm_tokens", len(result) // 4, kind="completion")
+        if result.strip():
+            cache.set("summary", cache_key, result)
+        return result
+
+
+def query_together_ai(prompt):
+    """Generates a summary using Together AI and cleans it before returning."""
+    try:
+        return clean_summary(request_together_ai(prompt))  # Clean summary before returning
+    except Exception as e:
+        print(f"Error querying Together AI: {e}")  # Debugging
+        return None
+
+
+def generate_summaries_with_together_ai(combined_text, num_pages, single_request=None, errors=None, on_update=None):
+    """Returns (extractive, abstractive, highlights), requesting all three concurrently.
+
+    With single_request, one prompt asks for all three sections and the response is split back
+    into them. Text over the token budget is summarized chunk by chunk first; if any chunk fails,
+    all three sections fail. Sections that fail are returned as None, with the reason added to
+    errors if given. on_update(name, text_so_far)
+    is called from worker threads as each section streams in.
+    """
+    if single_request is None:
+        single_request = SUMMARY_MODE == "single"
+
+    # Bills too long for one request are first condensed chunk by chunk (the map step);
+    # the three prompts below then act as the reduce step over the partial summaries
+    combined_text, chunk_failures = condense_text(combined_text, lambda prompt: clean_summary(request_together_ai(prompt)),
+                                                  max_workers=LLM_WORKERS)
+    if chunk_failures:
+        # Summarizing what's left would silently drop the failed parts of the bill
+        for part, error in chunk_failures.items():
+            print(f"Summary of {part} failed: {error}")  # Debugging
+        if errors is not None:
+            errors.update({f"chunk {part}": error for part, error in chunk_failures.items()})
+            errors.update({name: f"{', '.join(sorted(chunk_failures))} of the bill could not be summarized"
+                           for name in SECTION_NAMES})
+        return None, None, None
+
+    extractive_instruction = f"Generate an extractive summary with {min(num_pages, 4)} paragraphs"
+    abstractive_instruction = "Generate an abstractive summary in 2 paragraphs"
+    highlights_instruction = "Generate highlights in 15-20 bullet points under 4 headings"
+
+    if single_request:
+        prompt = build_combined_prompt(extractive_instruction, abstractive_instruction, highlights_instruction,
+                                       combined_text)
+        def update_sections(text):
+            for name, section in parse_combined_response(text)[0].items():
+                on_update(name, clean_summary(section))
+
+        responses, failures = run_concurrently({
+            "combined": lambda: request_together_ai(prompt, update_sections if on_update else None)
+        })
+        if "combined" in failures:
+            failures = {name: failures["combined"] for name in SECTION_NAMES}
+            sections = {}
+        else:
+            sections, failures = parse_combined_response(responses["combined"])
+        results = {name: clean_summary(text) for name, text in sections.items()}
+    else:
+        prompts = {
+            "extractive": f"{extractive_instruction}:\n\n{combined_text}",
+            "abstractive": f"{abstractive_instruction}:\n\n{combined_text}",
+            "highlights": f"{highlights_instruction}:\n\n{combined_text}",
+        }
+        def section_updater(name):
+            if on_update:
+                return lambda text: on_update(name, clean_summary(text))
+            return None
+
+        results, failures = run_concurrently({
+            name: (lambda name=name, prompt=prompt: clean_summary(request_together_ai(prompt, section_updater(name))))
+            for name, prompt in prompts.items()
+        })
+
+    for name in SECTION_NAMES:
+        if name in results and not results[name]:
+            del results[name]
+            failures[name] = "empty response"
+    for name, error in failures.items():
+        print(f"{name.capitalize()} summary failed: {error}")  # Debugging
+    if errors is not None:
+        errors.update(failures)
+
+    return tuple(results.get(name) for name in SECTION_NAMES)
+
+
+def update_summaries(prior_summaries, changes_text, errors=None):
+    """Revises a previous version's summaries from the changed sections alone.
+
+    Returns ((extractive, abstractive, highlights), what_changed); failed parts are None, with the
+    reason added to errors if given.
+    """
+    labels = {"extractive": "extractive summary", "abstractive": "abstractive summary",
+              "highlights": "highlights and analysis"}
+    prompts = {
+        name: (f"Here is the {labels[name]} of the previous version of a bill:\n\n{prior}\n\n"
+               f"The new version of the bill makes these section changes:\n\n{changes_text}\n\n"
+               f"Rewrite the {labels[name]} so it describes the new version. Keep its format and length, "
+               f"and keep everything the changes do not affect.")
+        for name, prior in zip(SECTION_NAMES, prior_summaries)
+    }
+    prompts["what_changed"] = ("Describe what changed between the previous and the new version of this bill "
+                               f"in 3-10 bullet points:\n\n{changes_text}")
+    results, failures = run_concurrently({
+        name: (lambda prompt=prompt: clean_summary(request_together_ai(prompt)))
+        for name, prompt in prompts.items()
+    })
+    for name in prompts:
+        if name in results and not results[name]:
+            del results[name]
+            failures[name] = "empty response"
+    for name, error in failures.items():
+        print(f"Updating {name} failed: {error}")  # Debugging
+    if errors is not None:
+        errors.update(failures)
+    return tuple(results.get(name) for name in SECTION_NAMES), results.get("what_changed")
+
+
+def summarize_bill(text, num_pages, key=None, bill_state=None, single_request=None, errors=None):
+    """Returns ((extractive, abstractive, highlights), what_changed).
+
+    If an earlier version of the bill was summarized (same key, or sharing most of its sections),
+    only the sections that changed are sent to the model, which revises the stored summaries and
+    describes the changes. Otherwise the bill is summarized in full and what_changed is None.
+    Every fully summarized version is stored for the next one.
+    """
+    if not VERSION_TRACKING:
+        return generate_summaries_with_together_ai(text, num_pages, single_request, errors), None
+
+    prior = versions.latest(key) if key else None
+    if prior is None:
+        prior = versions.find_similar(section_hashes(text), bill_state)
+    key = key or (prior and prior["bill_key"]) or f"{bill_state}:{hash_text(text)[:16]}"
+
+    summaries, what_changed = None, None
+    if prior and all(prior["summaries"]):
+        changes = diff_sections(prior["text"], text)
+        changes_text = format_changes(changes.changes)
+        if not changes.changes:
+            increment("bill_versions", result="unchanged")
+            summaries, what_changed = tuple(prior["summaries"]), "No changes from the previous version."
+        elif (changes.changed_share <= VERSION_MAX_CHANGED_SHARE
+              and estimate_tokens(changes_text) <= CHUNK_TOKEN_BUDGET):
+            print(f"{key}: re-summarizing {len(changes.changes)} changed section run(s) "
+                  f"({changes.changed_share:.0%} of the bill)")  # Debugging
+            increment("bill_versions", result="incremental")
+            summaries, what_changed = update_summaries(prior["summaries"], changes_text, errors)
+            if not all(summaries):
+                summaries, what_changed = None, None  # Fall back to a full summary below
+        else:
+            increment("bill_versions", result="too_different")
+
+    if summaries is None:
+        summaries = generate_summaries_with_together_ai(text, num_pages, single_request, errors)
+    if all(summaries):
+        versions.record(key, bill_state, text, summaries)
+    return summaries, what_changed
+
+
+def download_stage(job):
+    """Batch stage: fetches the row's PDF, or the webpage text for non-PDF URLs."""
+    with bill_timings(job.setdefault("timings", BillTimings())):
+        _download_stage(job)
+
+
+def _download_stage(job):
+    url = job["url"]
+    if url.lower().endswith(".pdf"):  # PDF URL
+        job["pdf_path"] = download_pdf_from_url(url)
+        if not job["pdf_path"]:
+            job["done"] = True
+    else:  # Webpage URL
+        job["text"], job["num_pages"] = extract_text_from_webpage(url), 3
+        if not job["text"].strip():
+            job["done"] = True
+
+
+def extract_stage(job):
+    """Batch stage: extracts the downloaded PDF's text."""
+    with bill_timings(job.setdefault("timings", BillTimings())):
+        _extract_stage(job)
+
+
+def _extract_stage(job):
+    if job.get("pdf_path"):
+        try:
+            job["text"], job["num_pages"] = extract_pdf_text(job["pdf_path"])
+        finally:
+            workspace.release(job["pdf_path"])  # Stored PDFs are kept from eviction until read
+        if workspace.in_memory:
+            job["pdf_path"] = pdf_label(job["pdf_path"])  # Only the text is needed from here on; drop the PDF's bytes
+        if not job["text"].strip():
+            job["done"] = True
+
+
+def summarize_stage(job):
+    """Batch stage: generates the three summaries."""
+    with bill_timings(job.setdefault("timings", BillTimings())):
+        key = bill_key(job["bill_state"], job["url"], job["text"], job.get("bill_number"))
+        job["summaries"], job["what_changed"] = summarize_bill(job["text"], job["num_pages"], key, job["bill_state"],
+                                                               job["single_request"])
+
+
+def row_completed(job):
+    """A row is journaled only if all three summaries were generated, so resuming retries rows whose
+    download, extraction or summaries failed."""
+    return bool(job.get("summaries")) and all(job["summaries"])
+
+
+def result_row(job):
+    abstractive_summary, extractive_summary, highlights_summary = "", "", ""
+    if job.get("summaries"):
+        extractive_summary = clean_summary(job["summaries"][0]) or "N/A"
+        abstractive_summary = clean_summary(job["summaries"][1]) or "N/A"
+        highlights_summary = clean_summary(job["summaries"][2]) or "N/A"
+    return {
+        "BillState": job["bill_state"],
+        "BillTextURL": job["url"],
+        "Extractive Summary": extractive_summary,
+        "Abstractive Summary": abstractive_summary,
+        "Highlights and Analysis": highlights_summary,
+        "What Changed": job.get("what_changed") or ""
+    }
+
+
+def read_sheet(excel_file):
+    """Opens a bill sheet for streaming, raising ValueError if it has no BillTextURL column."""
+    return SheetReader(excel_file)
+
+
+def _sheet_rows(sheet):
+    if isinstance(sheet, pd.DataFrame):
+        if "BillState" not in sheet.columns:
+            sheet = sheet.assign(BillState="Unknown")  # Default if missing
+        return (row for _, row in sheet.iterrows())
+    return iter(sheet)
+
+
+def summarize_sheet(sheet, sheet_id, single_request=None, download_workers=DOWNLOAD_WORKERS, ocr_workers=OCR_WORKERS,
+                    llm_workers=LLM_WORKERS, progress_callback=None, row_timings=None, writer=None):
+    """Summarizes every row of a bill sheet (a SheetReader or a DataFrame).
+
+    Returns the result rows in sheet order. Given a sheets.SheetWriter instead, each row is handed
+    to it as it completes and nothing is kept in memory, so None is returned.
+    Rows already journaled under sheet_id are reused; every newly finished row is journaled as it
+    completes. progress_callback(done, total) is called after each row, counting reused rows.
+    If row_timings is given, it is filled with {row_index: {stage: seconds}} for processed rows.
+    """
+    completed = journal.completed_row_indexes(sheet_id)
+    results = None if writer else []
+    total = len(sheet)
+
+    def jobs():
+        # Built lazily so run_stages' in-flight bound also covers reading rows from the sheet
+        for row_index, row in enumerate(_sheet_rows(sheet)):
+            if row_index in completed:
+                if writer:
+                    writer.add(row_index)  # Loaded from the journal when its turn to be written comes
+                else:
+                    results.append(journal.result(sheet_id, row_index))
+                continue
+            if results is not None:
+                results.append(None)  # Filled in as the row completes, keeping original row order
+            yield {"row_index": row_index, "url": str(row["BillTextURL"]).strip(), "bill_state": row["BillState"],
+                   "bill_number": row.get("BillNumber"), "single_request": single_request}
+
+    stages = [
+        ("download", download_stage, download_workers),
+        ("extract", extract_stage, ocr_workers),
+        ("summarize", summarize_stage, llm_workers),
+    ]
+
+    resumed = sum(1 for row_index in completed if row_index < total)
+    if resumed:
+        print(f"Resuming sheet {sheet_id[:12]}: {resumed} of {total} rows already done")  # Debugging
+    if progress_callback:
+        progress_callback(resumed, total)
+    for done, (_, job) in enumerate(run_stages(jobs(), stages), start=resumed + 1):
+        row_index = job["row_index"]
+        result = result_row(job)
+        if row_timings is not None and "timings" in job:
+            row_timings[row_index] = job["timings"].as_dict()
+        if job.get("error"):
+            print(f"Row {row_index + 1} failed in {job['error']}")  # Debugging
+        elif row_completed(job):
+            journal.record(sheet_id, row_index, result)
+        if writer:
+            writer.add(row_index, result)
+        else:
+            results[row_index] = result
+        # The bill text is no longer needed; don't let finished rows hold on to it
+        job.pop("text", None)
+        job.pop("summaries", None)
+        if progress_callback:
+            progress_callback(done, total)
+    return results
+
+
+def summarize_url(url, single_request=None, errors=None, timings=None):
+    """Summarizes a single PDF or webpage URL; returns (extractive, abstractive, highlights) or None.
+
+    If a BillTimings is given, the per-stage seconds are added to it.
+    """
+    job = {"url": url, "single_request": single_request, "timings": timings or BillTimings()}
+    download_stage(job)
+    if not job.get("done"):
+        extract_stage(job)
+    if job.get("done"):
+        return None
+    with bill_timings(job["timings"]):
+        return generate_summaries_with_together_ai(job["text"], job["num_pages"], single_request, errors)
@@ -0,0 +1,182 @@
+"""Page image cleanup ahead of Tesseract for the adaptive OCR mode.
+
+Bill scans are typeset black-on-white text, so a global Otsu threshold, a small deskew and
+cropping away margins and the line-number gutter give Tesseract less to look at without losing
+anything worth reading.
+"""
+import numpy as np
+from PIL import Image
+
+# Skew angles tried, in degrees; scanned bills are rarely more than a few degrees off
+MAX_SKEW_DEGREES = 3.0
+SKEW_STEP_DEGREES = 0.25
+# Skew is estimated on a copy this wide to keep the search cheap
+SKEW_ESTIMATE_WIDTH = 800
+# Vertical ink runs longer than this share of the page height are ruled margin lines, not text
+RULE_LINE_SHARE = 0.5
+RULE_LINE_WIDTH = 5
+# A line-number gutter is a narrow inked strip at the left edge of the text, then a wide blank gap
+MAX_GUTTER_SHARE = 0.08
+MIN_GUTTER_GAP_SHARE = 0.015
+# Line numbers sit beside nearly every text line; hanging-indent clause markers such as "(a)" only
+# beside the first line of each clause
+GUTTER_LINE_SHARE = 0.8
+MIN_GUTTER_LINES = 5
+MARGIN_PADDING = 10
+
+
+def to_grayscale(image):
+    return image if image.mode == "L" else image.convert("L")
+
+
+def otsu_threshold(pixels):
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(histogram)
+    means = np.cumsum(histogram * np.arange(256))
+    total_weight, total_mean = weights[-1], means[-1]
+    background = total_weight - weights
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (total_mean * weights - means * total_weight) ** 2 / (weights * background)
+    return int(np.nanargmax(between[:-1]))
+
+
+def binarize(image):
+    """Returns the page as an "L" image holding only 0 (ink) and 255 (paper).
+
+    A page of a single shade, such as a blank separator sheet, has no threshold and is returned
+    unchanged in grayscale.
+    """
+    gray = to_grayscale(image)
+    pixels = np.asarray(gray)
+    if pixels.min() == pixels.max():
+        return gray
+    threshold = otsu_threshold(pixels)
+    return Image.fromarray(np.where(pixels > threshold, 255, 0).astype(np.uint8), "L")
+
+
+def estimate_skew(binary):
+    """Returns the rotation, in degrees, that lines the text rows up horizontally.
+
+    Text rows give the sharpest horizontal ink profile when level, so the angle with the largest
+    variance of per-row ink counts wins.
+    """
+    scale = min(1.0, SKEW_ESTIMATE_WIDTH / binary.width)
+    small = binary.resize((max(1, int(binary.width * scale)), max(1, int(binary.height * scale))))
+    best_angle, best_score = 0.0, -1.0
+    angles = np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + SKEW_STEP_DEGREES / 2, SKEW_STEP_DEGREES)
+    # Smallest rotations first, so ties (a blank page scores the same at every angle) leave the page level
+    for angle in sorted(angles, key=abs):
+        rotated = small.rotate(float(angle), resample=Image.NEAREST, fillcolor=255)
+        ink = (np.asarray(rotated) < 128).sum(axis=1)
+        score = float(ink.var())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def deskew(binary):
+    darkest, lightest = binary.getextrema()
+    if darkest == lightest:
+        return binary  # Blank or solid page
+    angle = estimate_skew(binary)
+    if abs(angle) < SKEW_STEP_DEGREES / 2:
+        return binary
+    return binary.rotate(angle, resample=Image.NEAREST, expand=True, fillcolor=255)
+
+
+def _runs(mask):
+    """Returns (start, end) of each run of True values in a 1-D mask."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def _longest_run(column):
+    return max((end - start for start, end in _runs(column)), default=0)
+
+
+def remove_rule_lines(ink):
+    """Blanks ruled margin lines (unbroken vertical runs over most of the page height) in place.
+
+    Neighbouring columns are merged first so a line left slightly slanted after deskewing still
+    counts as one run.
+    """
+    spread = ink.copy()
+    for shift in range(1, RULE_LINE_WIDTH // 2 + 1):
+        spread[:, shift:] |= ink[:, :-shift]
+        spread[:, :-shift] |= ink[:, shift:]
+    min_run = RULE_LINE_SHARE * ink.shape[0]
+    for x in np.flatnonzero(spread.sum(axis=0) > min_run):
+        if _longest_run(spread[:, x]) > min_run:
+            ink[:, max(x - RULE_LINE_WIDTH // 2, 0):x + RULE_LINE_WIDTH // 2 + 1] = False
+    return ink
+
+
+def _blank_runs(columns, start, stop):
+    run_start = None
+    for x in range(start, stop):
+        if columns[x] == 0 and run_start is None:
+            run_start = x
+        elif columns[x] != 0 and run_start is not None:
+            yield run_start, x
+            run_start = None
+    if run_start is not None:
+        yield run_start, stop
+
+
+def _looks_like_line_numbers(ink, strip_start, strip_end, text_start):
+    """True if the strip holds a line-sized mark beside most text lines, as a line-number gutter does."""
+    lines = _runs(ink[:, text_start:].any(axis=1))
+    if len(lines) < MIN_GUTTER_LINES:
+        return False
+    strip = ink[:, strip_start:strip_end].any(axis=1)
+    line_height = float(np.median([end - start for start, end in lines]))
+    if any(end - start > 1.5 * line_height for start, end in _runs(strip)):
+        return False  # Taller than a line of text, so not a column of numbers
+    marked = sum(1 for start, end in lines if strip[start:end].any())
+    return marked >= GUTTER_LINE_SHARE * len(lines)
+
+
+def gutter_edge(ink):
+    """Returns the x where the text starts if the page has a line-number gutter on the left, else None.
+
+    A narrow inked strip followed by a wide gap only counts if it marks most text lines, so the
+    labels of hanging-indent clauses are left alone.
+    """
+    columns = ink.sum(axis=0)
+    inked = np.flatnonzero(columns)
+    if not len(inked):
+        return None
+    left, right = int(inked[0]), int(inked[-1])
+    width = right - left + 1
+    gutter_limit = left + int(width * MAX_GUTTER_SHARE)
+    min_gap = width * MIN_GUTTER_GAP_SHARE
+    gaps = [(gap_end - gap_start, gap_end, gap_start)
+            for gap_start, gap_end in _blank_runs(columns, left, min(right, gutter_limit + int(min_gap) + 1))
+            if gap_start <= gutter_limit and gap_end - gap_start >= min_gap]
+    if not gaps:
+        return None
+    # The gap between the numbers and the text is the widest one
+    _, gap_end, gap_start = max(gaps)
+    return gap_end if _looks_like_line_numbers(ink, left, gap_start, gap_end) else None
+
+
+def crop_to_text(binary):
+    """Drops ruled lines and any line-number gutter, then crops the margins, keeping a little padding."""
+    ink = np.asarray(binary) < 128
+    if ink.all() or not ink.any():
+        return binary  # Blank or solid page: nothing to crop
+    ink = remove_rule_lines(ink)
+    edge = gutter_edge(ink)
+    if edge is not None:
+        ink[:, :edge] = False
+    xs, ys = np.flatnonzero(ink.sum(axis=0)), np.flatnonzero(ink.sum(axis=1))
+    if not len(xs) or not len(ys):
+        return binary
+    box = (max(int(xs[0]) - MARGIN_PADDING, 0), max(int(ys[0]) - MARGIN_PADDING, 0),
+           min(int(xs[-1]) + MARGIN_PADDING + 1, binary.width), min(int(ys[-1]) + MARGIN_PADDING + 1, binary.height))
+    return Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), "L").crop(box)
+
+
+def preprocess_page(image):
+    """Binarizes, deskews and crops a page image for OCR."""
+    return crop_to_text(deskew(binarize(image)))
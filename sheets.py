@@ -0,0 +1,155 @@
+import io
+import os
+import csv
+import shutil
+import threading
+
+from openpyxl import load_workbook
+import xlsxwriter
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:  # Parquet output is optional
+    pyarrow = None
+
+RESULT_COLUMNS = ["BillState", "BillTextURL", "Extractive Summary", "Abstractive Summary",
+                  "Highlights and Analysis", "What Changed"]
+OUTPUT_FORMATS = ("xlsx", "csv", "parquet")
+MIME_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+XLSX_MAX_CELL_CHARS = 32767
+
+
+class SheetReader:
+    """Streams the rows of a bill sheet with openpyxl's read-only mode instead of loading it whole.
+
+    Raises ValueError if the sheet has no BillTextURL column. Iterating yields one dict per
+    non-blank row with BillTextURL, BillState ("Unknown" if the column is missing) and BillNumber.
+    """
+
+    def __init__(self, excel_file):
+        self._workbook = load_workbook(excel_file, read_only=True, data_only=True)
+        self._sheet = self._workbook.worksheets[0]
+        header = next(self._sheet.iter_rows(max_row=1, values_only=True), ())
+        self.columns = {str(name).strip(): i for i, name in enumerate(header) if name is not None}
+        if "BillTextURL" not in self.columns:
+            self.close()
+            raise ValueError("The sheet has no BillTextURL column")
+        self._length = sum(1 for _ in self._rows())
+
+    def _rows(self):
+        for values in self._sheet.iter_rows(min_row=2, values_only=True):
+            if any(value is not None and str(value).strip() for value in values):
+                yield values
+
+    def _value(self, values, column, default=None):
+        i = self.columns.get(column)
+        value = values[i] if i is not None and i < len(values) else None
+        return default if value is None else value
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for values in self._rows():
+            yield {
+                "BillTextURL": str(self._value(values, "BillTextURL", "")).strip(),
+                "BillState": self._value(values, "BillState", "Unknown"),
+                "BillNumber": self._value(values, "BillNumber"),
+            }
+
+    def close(self):
+        self._workbook.close()
+
+
+class SheetWriter:
+    """Spools result rows to a CSV file in sheet order as they complete.
+
+    Rows that finish ahead of an earlier one wait in memory until the gap is filled, so only the
+    out-of-order window is held. add(row_index) without a row asks load_row(row_index) for it
+    when its turn comes, which lets resumed rows stay in the journal until they are written.
+    The spool can be exported at any time, which gives a partial download mid-run.
+    """
+
+    def __init__(self, path, load_row=None, columns=RESULT_COLUMNS):
+        self.path = path
+        self.load_row = load_row
+        self.rows_written = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._csv = csv.DictWriter(self._file, fieldnames=columns, extrasaction="ignore")
+        self._csv.writeheader()
+
+    def add(self, row_index, row=None):
+        with self._lock:
+            self._pending[row_index] = row
+            while self.rows_written in self._pending:
+                row = self._pending.pop(self.rows_written)
+                if row is None:
+                    row = self.load_row(self.rows_written)
+                self._csv.writerow(row)
+                self.rows_written += 1
+            self._file.flush()
+
+    def export(self, output, fmt="xlsx"):
+        """Writes the rows spooled so far to a path or binary file-like object."""
+        with self._lock:
+            self._file.flush()
+            export_rows(self.path, output, fmt)
+
+    def export_bytes(self, fmt="xlsx"):
+        buffer = io.BytesIO()
+        self.export(buffer, fmt)
+        return buffer.getvalue()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _write_xlsx(csv_path, output):
+    # constant_memory flushes each row to disk as soon as the next one starts
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True, "strings_to_urls": False})
+    worksheet = workbook.add_worksheet("Summaries")
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row_number, row in enumerate(csv.reader(f)):
+            for column, value in enumerate(row):
+                worksheet.write_string(row_number, column, value[:XLSX_MAX_CELL_CHARS])
+    workbook.close()
+
+
+def _write_parquet(csv_path, output):
+    if pyarrow is None:
+        raise ValueError("Parquet output needs pyarrow; install it or choose xlsx or csv")
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        columns = next(csv.reader(f))
+    reader = pyarrow.csv.open_csv(
+        csv_path,
+        parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+        convert_options=pyarrow.csv.ConvertOptions(column_types={name: pyarrow.string() for name in columns}),
+    )
+    with pyarrow.parquet.ParquetWriter(output, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+
+
+def export_rows(csv_path, output, fmt="xlsx"):
+    """Converts a spooled CSV of result rows to xlsx, csv or parquet, one row at a time."""
+    if fmt == "xlsx":
+        _write_xlsx(csv_path, output)
+    elif fmt == "parquet":
+        _write_parquet(csv_path, output)
+    elif fmt == "csv":
+        if isinstance(output, (str, os.PathLike)):
+            shutil.copyfile(csv_path, output)
+        else:
+            with open(csv_path, "rb") as f:
+                shutil.copyfileobj(f, output)
+    else:
+        raise ValueError(f"Unknown output format {fmt!r}; choose one of {', '.join(OUTPUT_FORMATS)}")
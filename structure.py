@@ -0,0 +1,90 @@
+import re
+
+from chunking import SECTION_PATTERN
+
+# "1. Short title and commencement.—(1) This Act may be called ..." puts the heading and the
+# first clause of an Indian Act's section on one line
+INLINE_HEADING_PATTERN = re.compile(r"^(\d+[A-Z]?)\.\s+([^.—–]{3,120}?)\.?\s*[—–]+\s*(.*)$")
+# "12. Penalties" or "3A Powers of the Board" standing alone on a line
+NUMBERED_HEADING_PATTERN = re.compile(r"^(\d{1,3}[A-Z]?)\.?\s+([A-Z][^.;:]{2,80})\.?$")
+SCHEDULE_PATTERN = re.compile(r"^(?:THE\s+)?(?:FIRST|SECOND|THIRD|FOURTH|FIFTH|SIXTH)?\s*SCHEDULE\b", re.IGNORECASE)
+# Clause markers that start a new paragraph even without a blank line: (1), (a), (iv), 1., a)
+CLAUSE_PATTERN = re.compile(r"^(?:\((?:\d+|[a-z]{1,4}|[A-Z])\)|\d+\.\s|[a-z]\)\s)")
+MAX_HEADING_CHARS = 100
+
+
+def _heading(line):
+    """Returns (identifier, heading_text, rest_of_line) if line is a heading, else None."""
+    match = INLINE_HEADING_PATTERN.match(line)
+    if match:
+        return match.group(1), match.group(2).strip(), match.group(3).strip()
+    if len(line) > MAX_HEADING_CHARS:
+        return None
+    match = SECTION_PATTERN.match(line) or SCHEDULE_PATTERN.match(line)
+    if match:
+        return match.group(0).rstrip(". "), line, ""
+    match = NUMBERED_HEADING_PATTERN.match(line)
+    if match and not line.endswith((",", ";")):
+        return match.group(1), match.group(2).strip(), ""
+    # Short all-caps lines such as "PRELIMINARY" or "STATEMENT OF OBJECTS AND REASONS"
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 4 and all(c.isupper() for c in letters) and not line.endswith((",", ";")):
+        return line, line, ""
+    return None
+
+
+def detect_structure(text):
+    """Splits OCR or text-layer output into headings and paragraphs.
+
+    Returns the same list of {"heading_identifier", "heading_text", "text_type", "text"} entries as
+    app_openAI.html_to_json, without a model call. Wrapped lines are joined back into paragraphs;
+    a paragraph ends at a blank line, a heading or a new clause marker.
+    """
+    json_data = []
+    paragraph = []
+
+    def end_paragraph():
+        if paragraph:
+            json_data.append({"heading_identifier": None, "heading_text": None, "text_type": "paragraph",
+                              "text": " ".join(paragraph)})
+            paragraph.clear()
+
+    for raw_line in text.splitlines():
+        line = " ".join(raw_line.split())
+        if not line:
+            end_paragraph()
+            continue
+        heading = _heading(line)
+        if heading:
+            identifier, heading_text, rest = heading
+            end_paragraph()
+            json_data.append({"heading_identifier": identifier, "heading_text": heading_text,
+                              "text_type": "heading", "text": None})
+            if rest:
+                paragraph.append(rest)
+            continue
+        if CLAUSE_PATTERN.match(line):
+            end_paragraph()
+        # Rejoin words OCR hyphenated across a line break
+        if paragraph and paragraph[-1].endswith("-") and line[:1].islower():
+            paragraph[-1] = paragraph[-1][:-1] + line
+        else:
+            paragraph.append(line)
+    end_paragraph()
+    return json_data
+
+
+def structure_to_text(json_data):
+    """Flattens structured entries back to text, one heading or paragraph per line, so the
+    section splitting in chunking still sees the headings."""
+    lines = []
+    for entry in json_data:
+        if entry["text_type"] == "heading" and entry["heading_text"]:
+            identifier = entry["heading_identifier"]
+            if identifier and identifier != entry["heading_text"] and not entry["heading_text"].startswith(identifier):
+                lines.append(f"{identifier}. {entry['heading_text']}")
+            else:
+                lines.append(entry["heading_text"])
+        elif entry["text"]:
+            lines.append(entry["text"])
+    return "\n".join(lines)
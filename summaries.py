@@ -0,0 +1,76 @@
+import os
+import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Shared deadline for all summary requests of one bill, in seconds
+SUMMARY_TIMEOUT = int(os.getenv("SUMMARY_TIMEOUT", 300))
+# "parallel" sends the three prompts concurrently, "single" asks for all three in one response
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "parallel")
+
+SECTION_NAMES = ("extractive", "abstractive", "highlights")
+SECTION_MARKERS = {
+    "extractive": "=== EXTRACTIVE SUMMARY ===",
+    "abstractive": "=== ABSTRACTIVE SUMMARY ===",
+    "highlights": "=== HIGHLIGHTS ===",
+}
+_MARKER_PATTERN = re.compile(
+    r"^[\s#*]*=+\s*(EXTRACTIVE SUMMARY|ABSTRACTIVE SUMMARY|HIGHLIGHTS)\s*=+[\s*]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def run_concurrently(tasks, timeout=SUMMARY_TIMEOUT, max_workers=None):
+    """Runs named zero-argument callables on a thread pool under one shared timeout.
+
+    Each task gets its own thread unless max_workers caps the pool. Returns (results, errors),
+    both keyed by task name. A task that raises or doesn't finish in time shows up in errors
+    instead of results.
+    """
+    results, errors = {}, {}
+    if not tasks:
+        return results, errors
+    executor = ThreadPoolExecutor(max_workers=min(max_workers or len(tasks), len(tasks)))
+    # Each task runs in a copy of the caller's context so per-bill timings follow it onto the thread
+    futures = {executor.submit(contextvars.copy_context().run, task): name for name, task in tasks.items()}
+    try:
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = str(e) or type(e).__name__
+        for future in not_done:
+            errors[futures[future]] = f"timed out after {timeout}s"
+    finally:
+        # Don't block on requests that overran the deadline
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results, errors
+
+
+def build_combined_prompt(extractive_instruction, abstractive_instruction, highlights_instruction, text):
+    return (
+        "Produce three sections for the text below. Start each section with its marker line exactly "
+        "as shown and write nothing before the first marker.\n\n"
+        f"{SECTION_MARKERS['extractive']}\n{extractive_instruction}\n\n"
+        f"{SECTION_MARKERS['abstractive']}\n{abstractive_instruction}\n\n"
+        f"{SECTION_MARKERS['highlights']}\n{highlights_instruction}\n\n"
+        f"Text:\n\n{text}"
+    )
+
+
+def parse_combined_response(response):
+    """Splits a single structured response back into its sections; returns (sections, errors)."""
+    sections, errors = {}, {}
+    matches = list(_MARKER_PATTERN.finditer(response or ""))
+    for i, match in enumerate(matches):
+        name = match.group(1).split()[0].lower()
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(response)
+        body = response[match.end():end].strip()
+        if body:
+            sections[name] = body
+    for name in SECTION_NAMES:
+        if name not in sections:
+            errors[name] = "section missing from combined response"
+    return sections, errors
@@ -0,0 +1,74 @@
+"""Headless entry point: summarize a bill sheet without the Streamlit UI.
+
+    python summarize.py sheet.xlsx -o out.xlsx
+
+The output format (xlsx, csv or parquet) follows the output file's extension.
+"""
+import os
+import sys
+import argparse
+
+from cache import hash_file
+from batch import DOWNLOAD_WORKERS, LLM_WORKERS, OCR_WORKERS
+from sheets import OUTPUT_FORMATS, SheetWriter
+import pipeline
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize every bill listed in an Excel sheet.")
+    parser.add_argument("sheet", help="xlsx file with a BillTextURL column (and optionally BillState)")
+    parser.add_argument("-o", "--output", default="Summarized_Bills.xlsx",
+                        help="where to write the summaries (.xlsx, .csv or .parquet)")
+    parser.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument("--ocr-workers", type=int, default=OCR_WORKERS)
+    parser.add_argument("--llm-workers", type=int, default=LLM_WORKERS)
+    parser.add_argument("--single-request", action="store_true", help="ask for all three summaries in one request")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the disk cache")
+    parser.add_argument("--restart", action="store_true", help="ignore progress saved by an earlier run of this sheet")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pipeline.cache.enabled = not args.no_cache
+    output_format = os.path.splitext(args.output)[1].lstrip(".").lower()
+    if output_format not in OUTPUT_FORMATS:
+        print(f"{args.output}: the output must end in .{', .'.join(OUTPUT_FORMATS)}", file=sys.stderr)
+        return 1
+
+    try:
+        sheet = pipeline.read_sheet(args.sheet)
+    except ValueError as e:
+        print(f"{args.sheet}: {e}", file=sys.stderr)
+        return 1
+
+    sheet_id = hash_file(args.sheet)
+    if args.restart:
+        pipeline.journal.clear(sheet_id)
+
+    def report_progress(done, total):
+        print(f"Processed {done}/{total} bills")
+
+    # Rows are spooled next to the output as they finish, so a long run can be inspected midway
+    spool_path = f"{args.output}.partial.csv"
+    writer = SheetWriter(spool_path, load_row=lambda row_index: pipeline.journal.result(sheet_id, row_index))
+    try:
+        pipeline.summarize_sheet(
+            sheet, sheet_id, single_request=args.single_request or None, download_workers=args.download_workers,
+            ocr_workers=args.ocr_workers, llm_workers=args.llm_workers, progress_callback=report_progress,
+            writer=writer
+        )
+        writer.export(args.output, output_format)
+    except ValueError as e:
+        print(f"{args.output}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        writer.close()
+        sheet.close()
+    os.remove(spool_path)
+    print(f"Wrote {writer.rows_written} summaries to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
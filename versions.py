@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import difflib
+import threading
+from collections import namedtuple
+
+from cache import hash_text
+from chunking import split_sections
+
+VERSIONS_PATH = os.getenv("BILL_VERSIONS", "bill_versions.sqlite3")
+VERSION_TRACKING = os.getenv("VERSION_TRACKING", "1") == "1"
+# Share of matching sections for an unnumbered document to count as a version of a stored bill
+VERSION_SIMILARITY = float(os.getenv("VERSION_SIMILARITY", 0.6))
+# Above this share of changed sections a fresh summary is cheaper and better than patching the old one
+VERSION_MAX_CHANGED_SHARE = float(os.getenv("VERSION_MAX_CHANGED_SHARE", 0.5))
+# Stored versions compared against when looking for a similar bill
+SIMILARITY_CANDIDATES = 500
+
+# "HB 1234", "S.B. 56", "AB-7", "HJR12" in URLs and file names
+BILL_NUMBER_PATTERN = re.compile(
+    r"(?<![A-Za-z])(HB|SB|AB|HF|SF|LB|HR|SR|HJR|SJR|HCR|SCR|H\.B\.|S\.B\.|A\.B\.)[\s._-]*0*(\d{1,5})(?!\d)",
+    re.IGNORECASE,
+)
+# "HOUSE BILL NO. 1234" on the bill's first page
+BILL_TITLE_PATTERN = re.compile(
+    r"\b(HOUSE|SENATE|ASSEMBLY)\s+(BILL|FILE|JOINT\s+RESOLUTION|CONCURRENT\s+RESOLUTION|RESOLUTION)"
+    r"\s+(?:NO\.?|NUMBER)?\s*0*(\d{1,5})\b",
+    re.IGNORECASE,
+)
+
+SectionChanges = namedtuple("SectionChanges", ["changes", "changed_share"])
+
+
+def _normalize(section):
+    return " ".join(section.lower().split())
+
+
+def section_hashes(text):
+    return [hash_text(_normalize(section)) for section in split_sections(text)]
+
+
+def bill_key(state, url="", text="", bill_number=None):
+    """Returns "STATE:HB1234" for the bill, or None if no bill number can be found.
+
+    The number comes from bill_number if given, else the URL, else the title on the first page.
+    A bill_number without a chamber prefix ("12" could be HB 12 or SB 12) is not used on its own.
+    """
+    number = None
+    if isinstance(bill_number, float) and bill_number.is_integer():
+        bill_number = int(bill_number)  # Excel hands numeric columns back as floats
+    value = str(bill_number).strip() if bill_number is not None else ""
+    if value and value.lower() != "nan":
+        match = BILL_NUMBER_PATTERN.search(value)
+        if match:
+            number = match.group(1).replace(".", "").upper() + match.group(2)
+        elif re.search(r"[A-Za-z]", value):
+            number = re.sub(r"[\s._-]+", "", value).upper()
+    if number is None:
+        match = BILL_NUMBER_PATTERN.search(url or "")
+        if match:
+            number = match.group(1).replace(".", "").upper() + match.group(2)
+    if number is None:
+        match = BILL_TITLE_PATTERN.search((text or "")[:3000])
+        if match:
+            initials = "".join(word[0] for word in match.group(2).split())
+            number = f"{match.group(1)[0]}{initials}{match.group(3)}".upper()
+    if number is None:
+        return None
+    return f"{str(state).strip().upper()}:{number}"
+
+
+def diff_sections(old_text, new_text):
+    """Diffs two versions of a bill section by section.
+
+    Returns SectionChanges(changes, changed_share), where changes is a list of
+    (old_sections, new_sections) pairs for every replaced, added (empty old) or removed (empty new)
+    run of sections, and changed_share is the fraction of the new version's sections touched.
+    """
+    old_sections, new_sections = split_sections(old_text), split_sections(new_text)
+    matcher = difflib.SequenceMatcher(
+        None, [_normalize(section) for section in old_sections], [_normalize(section) for section in new_sections],
+        autojunk=False,
+    )
+    changes = []
+    changed = 0
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        changes.append((old_sections[old_start:old_end], new_sections[new_start:new_end]))
+        changed += max(new_end - new_start, old_end - old_start)
+    return SectionChanges(changes, changed / max(len(new_sections), 1))
+
+
+def format_changes(changes):
+    """Renders section changes as plain text for a prompt."""
+    parts = []
+    for old_sections, new_sections in changes:
+        old, new = "".join(old_sections).strip(), "".join(new_sections).strip()
+        if old and new:
+            parts.append(f"CHANGED SECTION\nPrevious version:\n{old}\n\nNew version:\n{new}")
+        elif new:
+            parts.append(f"ADDED SECTION\n{new}")
+        else:
+            parts.append(f"REMOVED SECTION\n{old}")
+    return "\n\n".join(parts)
+
+
+class BillVersionStore:
+    """SQLite store of every summarized bill version, so a later amended, engrossed or enrolled
+    version can be diffed against it and only the changed sections re-summarized."""
+
+    def __init__(self, path=VERSIONS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        # Opened on first use, so importing the pipeline doesn't create the file; callers hold _lock
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            with self._connection:
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS bill_versions ("
+                    "bill_key TEXT NOT NULL, state TEXT, text_hash TEXT NOT NULL, text BLOB NOT NULL, "
+                    "section_hashes TEXT NOT NULL, summaries TEXT NOT NULL, stored_at REAL NOT NULL, "
+                    "PRIMARY KEY (bill_key, text_hash))"
+                )
+                self._connection.execute(
+                    "CREATE INDEX IF NOT EXISTS bill_versions_state ON bill_versions (state, stored_at)"
+                )
+        return self._connection
+
+    def _row(self, row):
+        bill_key, text, summaries = row
+        return {"bill_key": bill_key, "text": zlib.decompress(text).decode("utf-8"),
+                "summaries": json.loads(summaries)}
+
+    def latest(self, bill_key):
+        """Returns the most recently stored version of the bill, or None."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT bill_key, text, summaries FROM bill_versions WHERE bill_key = ? "
+                "ORDER BY stored_at DESC LIMIT 1", (bill_key,)
+            ).fetchone()
+        return self._row(row) if row else None
+
+    def find_similar(self, hashes, state=None, min_similarity=VERSION_SIMILARITY):
+        """Returns the stored version sharing the most sections with hashes (Jaccard similarity of
+        the section sets, at least min_similarity), preferring the same state, or None."""
+        hashes = set(hashes)
+        if not hashes:
+            return None
+        with self._lock:
+            if state is None:
+                cursor = self._connect().execute(
+                    "SELECT rowid, section_hashes FROM bill_versions ORDER BY stored_at DESC LIMIT ?",
+                    (SIMILARITY_CANDIDATES,),
+                )
+            else:
+                cursor = self._connect().execute(
+                    "SELECT rowid, section_hashes FROM bill_versions WHERE state = ? ORDER BY stored_at DESC LIMIT ?",
+                    (str(state), SIMILARITY_CANDIDATES),
+                )
+            candidates = cursor.fetchall()
+
+        best_rowid, best_similarity = None, min_similarity
+        for rowid, stored in candidates:
+            stored = set(json.loads(stored))
+            similarity = len(hashes & stored) / len(hashes | stored)
+            if similarity >= best_similarity:
+                best_rowid, best_similarity = rowid, similarity
+        if best_rowid is None:
+            return None
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT bill_key, text, summaries FROM bill_versions WHERE rowid = ?", (best_rowid,)
+            ).fetchone()
+        return self._row(row) if row else None
+
+    def record(self, bill_key, state, text, summaries):
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO bill_versions "
+                "(bill_key, state, text_hash, text, section_hashes, summaries, stored_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (bill_key, None if state is None else str(state), hash_text(text),
+                 zlib.compress(text.encode("utf-8")), json.dumps(section_hashes(text)), json.dumps(list(summaries)),
+                 time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
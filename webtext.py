@@ -0,0 +1,159 @@
+import os
+
+from bs4 import BeautifulSoup
+
+from chunking import estimate_tokens
+
+# "main" keeps only the page's main content; "full" sends the whole page text as before
+WEBPAGE_EXTRACTION = os.getenv("WEBPAGE_EXTRACTION", "main")
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+BOILERPLATE_TAGS = ("script", "style", "noscript", "template", "nav", "aside", "form",
+                    "iframe", "svg", "button", "select", "input", "label", "link", "meta")
+# Whole id/class names legislature CMSs use for page chrome; partial matches such as "section-header"
+# or "has-sidebar" are left alone, since bill headings and layout wrappers use them too
+BOILERPLATE_NAMES = {
+    "nav", "navbar", "navigation", "menu", "main-menu", "main-nav", "site-nav", "breadcrumb", "breadcrumbs",
+    "footer", "site-footer", "page-footer", "header", "site-header", "page-header", "masthead", "sidebar",
+    "banner", "cookie", "cookies", "cookie-banner", "social", "share", "skip", "skip-link", "search",
+    "login", "toolbar", "pagination", "related",
+}
+MAIN_CONTENT_SELECTORS = ("main", "[role=main]", "article", "#content", "#main-content", "#maincontent",
+                          ".bill-text", "#billtext", ".content")
+BLOCK_TAGS = ("p", "div", "section", "article", "main", "li", "tr", "table", "pre", "blockquote", "dd", "dt",
+              "h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "center", "td", "th")
+HEADING_TAGS = ("h1", "h2", "h3", "h4", "h5", "h6")
+# Share of a container's text that must sit in one child before we descend into that child
+DOMINANT_CHILD_SHARE = 0.8
+# Lists and tables that are mostly links are menus, not bill text
+MAX_LINK_DENSITY = 0.75
+# Below this the main-content guess probably missed, so fall back to the whole page
+MIN_MAIN_CONTENT_SHARE = 0.2
+
+
+def _text_length(element):
+    return len(" ".join(element.get_text(" ").split()))
+
+
+def _link_density(element):
+    length = _text_length(element)
+    if not length:
+        return 0.0
+    return sum(_text_length(link) for link in element.find_all("a")) / length
+
+
+def _is_boilerplate(element):
+    if element.attrs is None:  # Already removed with an ancestor
+        return False
+    names = [element.get("id") or ""] + list(element.get("class") or [])
+    return any(name.lower() in BOILERPLATE_NAMES for name in names)
+
+
+def _protected_elements(soup):
+    """Returns the ids of elements that must survive: main-content candidates, headings and
+    everything containing either."""
+    protected = set()
+    for element in soup.select(", ".join(MAIN_CONTENT_SELECTORS)) + soup.find_all(HEADING_TAGS):
+        protected.add(id(element))
+        protected.update(id(parent) for parent in element.parents)
+    return protected
+
+
+def strip_boilerplate(soup):
+    """Removes scripts, navigation, headers/footers, sidebars and link-only menus in place, keeping
+    headings and the main content."""
+    for element in soup.find_all(BOILERPLATE_TAGS):
+        element.decompose()
+    protected = _protected_elements(soup)
+
+    def removable(element):
+        return element.attrs is not None and id(element) not in protected
+
+    # Page headers and footers go, but an article's own header usually carries the bill title
+    for element in soup.find_all(("header", "footer")):
+        if removable(element) and element.find_parent(("main", "article")) is None:
+            element.decompose()
+    for element in soup.find_all(_is_boilerplate):
+        if removable(element) and element.name not in ("html", "body", "main", "article"):
+            element.decompose()
+    for element in soup.find_all(("ul", "ol", "table")):
+        if removable(element) and _link_density(element) > MAX_LINK_DENSITY:
+            element.decompose()
+
+
+def find_main_content(soup):
+    """Returns (element, headings): the element holding the page's main text and the headings
+    passed over on the way to it.
+
+    Uses an explicit main-content container when the page has one, otherwise starts at <body> and
+    keeps descending into the child that holds nearly all of the remaining text. Headings that
+    come before that child, such as the bill title in an <h1> above the bill text, are collected
+    so descending doesn't drop them.
+    """
+    body = soup.body or soup
+    total = _text_length(body)
+    for selector in MAIN_CONTENT_SELECTORS:
+        candidate = soup.select_one(selector)
+        if candidate is not None and total and _text_length(candidate) >= MIN_MAIN_CONTENT_SHARE * total:
+            return candidate, []
+
+    element = body
+    headings = []
+    while True:
+        length = _text_length(element)
+        children = element.find_all(recursive=False)
+        dominant = max((child for child in children if child.name not in HEADING_TAGS), key=_text_length, default=None)
+        if dominant is None or not length or _text_length(dominant) < DOMINANT_CHILD_SHARE * length:
+            return element, headings
+        for child in children[:children.index(dominant)]:
+            headings.extend([child] if child.name in HEADING_TAGS else child.find_all(HEADING_TAGS))
+        element = dominant
+
+
+def element_text(element):
+    """Returns the element's text with one line per block, whitespace collapsed and blank or
+    repeated lines dropped, so headings and numbered clauses stay on lines of their own."""
+    for br in element.find_all("br"):
+        br.replace_with("\n")
+    for block in element.find_all(BLOCK_TAGS):
+        block.insert_before("\n")
+        block.insert_after("\n")
+
+    lines = []
+    for line in element.get_text().splitlines():
+        line = " ".join(line.split())
+        if line and (not lines or line != lines[-1]):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def extract_main_text(html, mode=None):
+    """Returns (text, stats) for an HTML page.
+
+    stats has the estimated tokens of the whole page text ("full_tokens"), of the text returned
+    ("tokens") and the difference ("saved_tokens").
+    """
+    mode = mode or WEBPAGE_EXTRACTION
+    soup = BeautifulSoup(html, HTML_PARSER)
+    full_text = " ".join(soup.get_text(separator=" ").split())
+
+    text = full_text
+    if mode == "main":
+        strip_boilerplate(soup)
+        element, headings = find_main_content(soup)
+        heading_lines = [" ".join(heading.get_text(" ").split()) for heading in headings]
+        main_text = "\n".join([line for line in heading_lines if line] + [element_text(element)])
+        if len(main_text) >= MIN_MAIN_CONTENT_SHARE * len(full_text):
+            text = main_text
+        else:
+            print(f"Main content looked too short ({len(main_text)} of {len(full_text)} chars), "
+                  f"using the whole page")  # Debugging
+
+    full_tokens = estimate_tokens(full_text)
+    tokens = estimate_tokens(text)
+    return text, {"full_tokens": full_tokens, "tokens": tokens, "saved_tokens": max(full_tokens - tokens, 0)}
@@ -0,0 +1,192 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from collections import Counter
+
+from cache import hash_bytes
+
+WORKSPACE_FOLDER = os.getenv("WORKSPACE_DIR", "workspace")
+WORKSPACE_MAX_BYTES = int(os.getenv("WORKSPACE_MAX_MB", "2048")) * 1024 * 1024
+WORKSPACE_MAX_AGE = float(os.getenv("WORKSPACE_MAX_AGE_HOURS", "24")) * 3600
+# Keep uploaded and downloaded PDFs in memory only; nothing is written to the workspace folder
+WORKSPACE_IN_MEMORY = os.getenv("WORKSPACE_IN_MEMORY", "off").lower() in ("1", "on", "true", "yes")
+
+# Evict down to this fraction of the limit so we don't rescan the folder on every write
+EVICTION_TARGET = 0.9
+# Seconds between scans for files past WORKSPACE_MAX_AGE
+AGE_CHECK_INTERVAL = 600
+
+
+class Workspace:
+    """Bounded scratch storage for uploaded and downloaded PDFs and per-job files.
+
+    PDFs are stored as folder/files/<sha256>.pdf, so each document is written once and concurrent
+    sessions uploading different files with the same name never overwrite each other. Every job
+    gets its own temporary directory under folder/jobs/. Files untouched for max_age seconds are
+    deleted, then the least recently used ones until the workspace is back under max_bytes;
+    directories of jobs still running and stored files not yet released are never touched. With
+    in_memory, store() hands the bytes back instead of writing them, and the OCR code reads the
+    PDF straight from memory.
+    """
+
+    def __init__(self, folder=WORKSPACE_FOLDER, max_bytes=WORKSPACE_MAX_BYTES, max_age=WORKSPACE_MAX_AGE,
+                 in_memory=WORKSPACE_IN_MEMORY):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.in_memory = in_memory
+        self.evicted = 0
+        self._size = None
+        self._last_age_check = 0.0
+        self._active_jobs = set()
+        self._in_use = Counter()  # Stored file -> callers that haven't released it yet
+        self._lock = threading.Lock()
+
+    def store(self, data, suffix=".pdf"):
+        """Returns the path of a file holding data, or data itself when running in memory.
+
+        The file is kept from eviction until release(path) is called, once per store().
+        """
+        if self.in_memory:
+            return data
+        key = hash_bytes(data)
+        path = os.path.join(self.folder, "files", key[:2], key + suffix)
+        with self._lock:
+            self._in_use[os.path.abspath(path)] += 1
+        try:
+            os.utime(path)  # Same content stored before: reuse it, now as the most recently used file
+            self._maybe_evict()
+            return path
+        except FileNotFoundError:
+            pass
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so another session never reads a partial PDF
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            self.release(path)
+            raise
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+        self._maybe_evict()
+        return path
+
+    def release(self, path):
+        """Lets eviction remove a file returned by store() once the caller is done reading it."""
+        if self.in_memory or not isinstance(path, str):
+            return
+        with self._lock:
+            path = os.path.abspath(path)
+            self._in_use[path] -= 1
+            if self._in_use[path] <= 0:
+                del self._in_use[path]
+
+    def create_job(self):
+        """Creates and returns a fresh directory for one job's files, protected from eviction
+        until finish_job()."""
+        jobs_folder = os.path.join(self.folder, "jobs")
+        os.makedirs(jobs_folder, exist_ok=True)
+        path = tempfile.mkdtemp(prefix="job-", dir=jobs_folder)
+        with self._lock:
+            self._active_jobs.add(os.path.abspath(path))
+        self._maybe_evict()
+        return path
+
+    def finish_job(self, path, remove=True):
+        """Deletes the job's directory, or with remove=False leaves its files for eviction to clean up."""
+        with self._lock:
+            self._active_jobs.discard(os.path.abspath(path))
+        if remove:
+            shutil.rmtree(path, ignore_errors=True)
+            with self._lock:
+                self._size = None
+
+    def _entries(self):
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def _maybe_evict(self):
+        with self._lock:
+            now = time.time()
+            age_check_due = self.max_age and now - self._last_age_check > AGE_CHECK_INTERVAL
+            if age_check_due:
+                self._last_age_check = now
+            over_limit = self.size() > self.max_bytes
+        if age_check_due or over_limit:
+            self.evict()
+
+    def evict(self):
+        """Deletes files older than max_age, then least recently used ones until the workspace is
+        under its size limit, and removes job directories left empty."""
+        with self._lock:
+            active_jobs = set(self._active_jobs)
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_TARGET
+        expired = time.time() - self.max_age if self.max_age else None
+        evicted = 0
+        for mtime, size, path in entries:
+            if total <= target and (expired is None or mtime >= expired):
+                continue
+            absolute = os.path.abspath(path)
+            if any(absolute.startswith(job + os.sep) for job in active_jobs):
+                continue
+            # Checked under the lock right before removing, so a concurrent store() that just
+            # reused this file either keeps it or finds it gone and writes it again
+            with self._lock:
+                if absolute in self._in_use:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                    evicted += 1
+                except OSError:
+                    pass
+        self._remove_empty_job_folders(active_jobs)
+        if evicted:
+            print(f"Evicted {evicted} workspace file(s), {total / 1e6:.1f} MB left")  # Debugging
+        with self._lock:
+            self.evicted += evicted
+            self._size = total
+
+    def _remove_empty_job_folders(self, active_jobs):
+        jobs_folder = os.path.join(self.folder, "jobs")
+        if not os.path.isdir(jobs_folder):
+            return
+        for name in os.listdir(jobs_folder):
+            path = os.path.join(jobs_folder, name)
+            try:
+                # A directory created moments ago may belong to a job that hasn't registered yet
+                if (os.path.abspath(path) in active_jobs or os.listdir(path)
+                        or time.time() - os.stat(path).st_mtime < AGE_CHECK_INTERVAL):
+                    continue
+                os.rmdir(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_memory": self.in_memory,
+                "size_bytes": 0 if self.in_memory else self.size(),
+                "max_bytes": self.max_bytes,
+                "active_jobs": len(self._active_jobs),
+                "evicted": self.evicted,
+            }